@@ -0,0 +1,127 @@
+import os
+import json
+import math
+from PIL import Image
+import requests
+from images import write_atomic
+
+# Default location of the atlas, can be overridden with ITEM_ATLAS_PATH.
+# The sheet is saved as <path>.png and its index as <path>.json.
+DEFAULT_ATLAS_PATH = 'cache/item_atlas'
+
+# Items per row of the packed sheet
+ATLAS_COLUMNS = 32
+
+
+def size_key(size):
+    return f'{size[0]}x{size[1]}'
+
+
+class ItemAtlas:
+    # One packed sheet holding every item icon at every size we render, plus
+    # the position of each icon in it
+    def __init__(self, sheet, index, game_version=None):
+        self.sheet = sheet
+        # size key -> item id -> (x, y)
+        self.index = index
+        self.game_version = game_version
+
+    def box(self, item_id, size):
+        position = self.index.get(size_key(size), {}).get(item_id)
+        if position is None:
+            return None
+        return (position[0], position[1], position[0] + size[0], position[1] + size[1])
+
+    def has(self, item_id, size):
+        return self.box(item_id, size) is not None
+
+    def paste(self, image, item_id, position, size):
+        # Blit one icon from the sheet onto image, returns False if the item
+        # isn't in the atlas
+        box = self.box(item_id, size)
+        if box is None:
+            return False
+        icon = self.sheet.crop(box)
+        image.paste(icon, position, icon)
+        return True
+
+    def save(self, path=None):
+        # Every render worker loads the atlas from the same path, so both
+        # files are replaced whole. The index goes last, a new index means a
+        # complete new sheet, see modified.
+        path = path or os.getenv('ITEM_ATLAS_PATH') or DEFAULT_ATLAS_PATH
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        write_atomic(path + '.png', lambda file: self.sheet.save(file, format='PNG'))
+        data = {
+            'game_version': self.game_version,
+            'index': {
+                key: {str(item_id): position for item_id, position in positions.items()}
+                for key, positions in self.index.items()
+            }
+        }
+        write_atomic(path + '.json', lambda file: json.dump(data, file), 'w')
+
+    @staticmethod
+    def modified(path=None):
+        # Identifies the saved atlas, None if there isn't one. Every save
+        # replaces the index file, so its inode changes even when the clock
+        # is too coarse for the modification time to.
+        path = path or os.getenv('ITEM_ATLAS_PATH') or DEFAULT_ATLAS_PATH
+        try:
+            stat = os.stat(path + '.json')
+            return stat.st_ino, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    @classmethod
+    def load(cls, path=None):
+        # Load a saved atlas, returns None if there isn't a usable one
+        path = path or os.getenv('ITEM_ATLAS_PATH') or DEFAULT_ATLAS_PATH
+        try:
+            with open(path + '.json') as file:
+                data = json.load(file)
+            sheet = Image.open(path + '.png')
+            sheet.load()
+        except (OSError, ValueError):
+            return None
+        index = {
+            key: {int(item_id): tuple(position) for item_id, position in positions.items()}
+            for key, positions in data.get('index', {}).items()
+        }
+        return cls(sheet, index, data.get('game_version'))
+
+
+def build_item_atlas(constants, image_cache, sizes, workers=8):
+    # Download (or read from the image cache) every item icon and pack them
+    # into one sheet, one grid of equally sized cells per size
+    urls = {item_id: constants.item_image_url(item_id) for item_id in constants.items}
+    urls = {item_id: url for item_id, url in urls.items() if url}
+    heights = sorted(set(size[1] for size in sizes))
+    image_cache.prefetch(urls.values(), heights, workers)
+
+    item_ids = sorted(urls)
+    columns = max(1, min(ATLAS_COLUMNS, len(item_ids)))
+    rows = math.ceil(len(item_ids) / columns)
+    sheet_width = max(size[0] for size in sizes) * columns
+    sheet_height = sum(size[1] * rows for size in sizes)
+    sheet = Image.new('RGBA', (max(sheet_width, 1), max(sheet_height, 1)), (0, 0, 0, 0))
+
+    index = {}
+    top = 0
+    for size in sizes:
+        positions = {}
+        for i, item_id in enumerate(item_ids):
+            try:
+                icon = image_cache.get(urls[item_id], size[1])
+            except (requests.RequestException, OSError):
+                continue
+            if icon.size != tuple(size):
+                icon = icon.resize(size)
+            x = (i % columns) * size[0]
+            y = top + (i // columns) * size[1]
+            sheet.paste(icon.convert('RGBA'), (x, y))
+            positions[item_id] = (x, y)
+        index[size_key(size)] = positions
+        top += size[1] * rows
+
+    return ItemAtlas(sheet, index, constants.game_version)
@@ -0,0 +1,56 @@
+import os
+import json
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+
+# Records real STRATZ responses into benchmarks/fixtures so benchmarks can
+# replay them through the stub server. Needs the usual .env credentials.
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+async def record(days, output):
+    import matches
+    from constants import CONSTANTS_FIELD
+    from queries import batch_accounts, execute
+
+    end_timestamp = int(datetime.now(timezone.utc).timestamp())
+    start_timestamp = int((datetime.now(timezone.utc) - timedelta(days=days)).timestamp())
+
+    async with matches.create_client() as client:
+        batches = batch_accounts(matches.STEAM_ACCOUNT_IDS)
+        fields = [matches.matches_field(batch, start_timestamp, end_timestamp) for batch in batches]
+        results = await execute(client, fields + [CONSTANTS_FIELD])
+
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+    # Merge the batches back into one players response
+    players = []
+    for result in results[:-1]:
+        players.extend(result['data']['players'] or [])
+
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, 'players.json'), 'w') as file:
+        json.dump({'data': {'players': players}}, file)
+    with open(os.path.join(output, 'constants.json'), 'w') as file:
+        json.dump(results[-1], file)
+
+    print(f"Recorded {sum(len(player.get('matches') or []) for player in players)} player matches to {output}")
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Record STRATZ responses as benchmark fixtures')
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--output', default=FIXTURES_PATH)
+    args = parser.parse_args()
+    asyncio.run(record(args.days, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import platform
+import threading
+import statistics
+import subprocess
+import contextlib
+import tracemalloc
+
+# Benchmarks for the fetch, process and render pipeline. Everything runs
+# against the local stub server, replaying recorded fixtures from
+# benchmarks/fixtures when there are any and synthetic responses otherwise.
+#
+#   python -m benchmarks.run                 run and save results
+#   python -m benchmarks.run --compare A B   compare two saved results
+
+BENCHMARKS_PATH = os.path.dirname(__file__)
+FIXTURES_PATH = os.path.join(BENCHMARKS_PATH, 'fixtures')
+RESULTS_PATH = os.path.join(BENCHMARKS_PATH, 'results')
+
+# Matches rendered by the batch rendering benchmarks
+BATCH_SIZE = 20
+
+
+def configure_environment(port, directory):
+    # Set before anything is created from them. Nothing is allowed to
+    # reach the real API or CDN.
+    os.environ['DOTA_API_ENDPOINT'] = f'http://127.0.0.1:{port}/graphql'
+    os.environ['DOTA_API_KEY'] = 'benchmark'
+    os.environ['DOTA_CDN_URL'] = f'http://127.0.0.1:{port}'
+    os.environ['IMAGE_CACHE_PATH'] = os.path.join(directory, 'images')
+    os.environ['ITEM_ATLAS_PATH'] = os.path.join(directory, 'item_atlas')
+    os.environ['CONSTANTS_PATH'] = os.path.join(directory, 'constants.json')
+    os.environ['MATCH_DB_PATH'] = os.path.join(directory, 'matches.db')
+
+
+def summarise(samples):
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'min_ms': ordered[0] * 1000,
+        'max_ms': ordered[-1] * 1000
+    }
+
+
+def measure(function, runs, warmup=1):
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return summarise(samples)
+
+
+async def measure_async(function, runs, warmup=1):
+    for _ in range(warmup):
+        await function()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await function()
+        samples.append(time.perf_counter() - started)
+    return summarise(samples)
+
+
+def retained_bytes(build):
+    # Memory still allocated by what build returns, once it has returned
+    tracemalloc.start()
+    try:
+        result = build()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, retained
+
+
+def measure_model_memory(account_ids, history, seed):
+    # Keeping a long history in memory, as compact Match records versus the
+    # nested dicts process_matches used to build
+    import matches
+    from benchmarks.synthetic import synthetic_players_response
+
+    response = synthetic_players_response(account_ids, history, seed)
+    compact, compact_bytes = retained_bytes(lambda: matches.process_matches(response, set()))
+    del response
+    _, dict_bytes = retained_bytes(lambda: [match.to_dict() for match in compact])
+    return {
+        'matches': len(compact),
+        'dict_bytes': dict_bytes,
+        'compact_bytes': compact_bytes,
+        'reduction': 1 - compact_bytes / dict_bytes if dict_bytes else 0.0
+    }
+
+
+async def start_stub_process(port, fixture_path):
+    # Stub in its own process, so its allocations stay out of tracemalloc
+    import aiohttp
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(BENCHMARKS_PATH), 'stub_server.py'),
+         '--port', str(port), '--fixture', fixture_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f'http://127.0.0.1:{port}/stats') as response:
+                    if response.status == 200:
+                        return process
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+    process.kill()
+    raise RuntimeError('stub server did not start')
+
+
+async def peak_bytes(run):
+    tracemalloc.start()
+    try:
+        await run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+async def measure_stream_memory(account_ids, windows, seed, port, directory):
+    # Peak memory of fetching everything versus streaming it, as the
+    # number of matches in the window grows
+    import matches
+    from benchmarks.synthetic import synthetic_players_response
+    from scheduler import RequestScheduler
+
+    results = []
+    for window in windows:
+        fixture_path = os.path.join(directory, f'players_{window}.json')
+        response = synthetic_players_response(account_ids, window, seed)
+
+        # Polling doesn't ask for the per-minute leads, the stub would
+        # replay them anyway
+        for player in response['data']['players']:
+            for match in player['matches']:
+                match.pop('radiantNetworthLeads', None)
+                match.pop('radiantExperienceLeads', None)
+
+        with open(fixture_path, 'w') as file:
+            json.dump(response, file)
+        del response
+
+        process = await start_stub_process(port, fixture_path)
+        try:
+            scheduler = RequestScheduler(per_second=1000, per_minute=60000)
+            # tracemalloc slows everything down, don't let the request time out
+            client = matches.StratzClient(
+                f'http://127.0.0.1:{port}/graphql', 'benchmark', timeout=600, scheduler=scheduler
+            )
+            async with client:
+                async def fetch():
+                    await matches.fetch_dota_matches_async(client)
+
+                async def stream():
+                    async for _ in matches.stream_dota_matches_async(client):
+                        pass
+
+                results.append({
+                    'window_matches': window,
+                    'fetch_peak_bytes': await peak_bytes(fetch),
+                    'stream_peak_bytes': await peak_bytes(stream)
+                })
+        finally:
+            process.kill()
+            process.wait()
+    return results
+
+
+def load_fixtures(account_ids, matches, seed):
+    from benchmarks.synthetic import synthetic_players_response, synthetic_constants_response
+
+    fixtures = {}
+    for name in ('players', 'constants'):
+        path = os.path.join(FIXTURES_PATH, f'{name}.json')
+        if os.path.exists(path):
+            with open(path) as file:
+                fixtures[name] = json.load(file)
+
+    source = 'recorded' if fixtures else 'synthetic'
+    fixtures.setdefault('players', synthetic_players_response(account_ids, matches, seed))
+    fixtures.setdefault('constants', synthetic_constants_response())
+    return fixtures, source
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_stub_server(app, port):
+    from aiohttp import web
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    started = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+        started.set()
+        loop.run_forever()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return stop
+
+
+async def run_benchmarks(args):
+    import matches
+    import draw
+    import tracing
+    from constants import ConstantsCache
+    from encoding import encode, compare_encodings
+    from render import RenderService
+    from scheduler import INTERACTIVE, RequestScheduler
+    from stub_server import create_app
+
+    fixtures, source = load_fixtures(matches.STEAM_ACCOUNT_IDS, args.matches, args.seed)
+    players_response = fixtures['players']
+    raw_matches = sum(len(player.get('matches') or []) for player in players_response['data']['players'])
+
+    # The stub gets its own thread and event loop, the image downloads
+    # under test are blocking calls that would otherwise stall it
+    stop_stub = start_stub_server(create_app(fixtures=fixtures, latency=args.latency), args.port)
+
+    if args.trace:
+        logging.getLogger('trace').setLevel(logging.DEBUG)
+
+    results = {}
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+    try:
+        with quiet:
+            results['process_matches'] = measure(
+                lambda: matches.process_matches(players_response, set()), args.runs
+            )
+            results['process_matches']['matches_per_second'] = (
+                raw_matches / (results['process_matches']['mean_ms'] / 1000)
+            )
+
+            # Loose rate limits so the scheduler doesn't dominate the numbers
+            scheduler = RequestScheduler(per_second=1000, per_minute=60000)
+            client = matches.StratzClient(
+                os.environ['DOTA_API_ENDPOINT'], os.environ['DOTA_API_KEY'], scheduler=scheduler
+            )
+            async with client:
+                results['fetch_dota_matches'] = await measure_async(
+                    lambda: matches.fetch_dota_matches_async(client), args.runs
+                )
+
+                async def stream():
+                    async for _ in matches.stream_dota_matches_async(client):
+                        pass
+
+                results['stream_dota_matches'] = await measure_async(stream, args.runs)
+
+                constants = ConstantsCache()
+                await constants.refresh(client)
+                started = time.perf_counter()
+                await asyncio.to_thread(draw.refresh_item_atlas, constants)
+                results['item_atlas_build'] = summarise([time.perf_counter() - started])
+
+                await asyncio.to_thread(draw.get_image_cache().prefetch_heroes, constants)
+
+                processed = matches.process_matches(players_response, set())
+                match = processed[0]
+
+                results['table_build'] = measure(lambda: draw.build_match_table(match), args.runs)
+                table = draw.build_match_table(match)
+                results['table_draw'] = measure(table.draw, args.runs)
+                text_cache = draw.get_text_cache().stats()
+                image = table.draw()
+                results['png_encode'] = measure(
+                    lambda: image.save(io.BytesIO(), format='PNG'), args.runs
+                )
+                encodings = compare_encodings(image, runs=args.runs)
+
+                # Synthetic matches carry both lead series for the full game
+                graph = draw.LeadGraphCell(
+                    match['radiant_networth_leads'], match['radiant_experience_leads'], width=image.width
+                )
+                graph_image = draw.Image.new('RGB', (graph.width, graph.height), (255, 255, 255))
+                graph_draw = draw.ImageDraw.Draw(graph_image)
+                results['lead_graph_draw'] = measure(
+                    lambda: graph.draw(graph_draw, graph_image, 0, 0, graph.width, graph.height), args.runs
+                )
+
+                # A night's worth of matches, one image each versus a few pages
+                batch = processed[:BATCH_SIZE]
+
+                def render_each():
+                    for batch_match in batch:
+                        encode(draw.build_match_table(batch_match).draw())
+
+                def render_pages():
+                    for page in draw.draw_match_pages(batch):
+                        encode(page)
+
+                results['batch_render_each'] = measure(render_each, args.runs)
+                results['batch_render_pages'] = measure(render_pages, args.runs)
+
+                # What a /match style command costs end to end: an interactive
+                # fetch followed by a render in the worker pool
+                service = RenderService()
+                try:
+                    async def command():
+                        fetched = await matches.fetch_dota_matches_async(client, priority=INTERACTIVE)
+                        return await service.render(fetched[0])
+
+                    results['match_command'] = await measure_async(command, args.runs)
+                finally:
+                    service.close()
+    finally:
+        stop_stub()
+
+    return {
+        'commit': git_commit(),
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'fixtures': source,
+        'raw_matches': raw_matches,
+        'latency_ms': args.latency * 1000,
+        'results': results,
+        'stages': tracing.export(),
+        'text_cache': text_cache,
+        'encodings': encodings,
+        'memory': measure_model_memory(matches.STEAM_ACCOUNT_IDS, args.history, args.seed),
+        'stream_memory': await measure_stream_memory(
+            matches.STEAM_ACCOUNT_IDS, args.windows, args.seed, args.port + 1, args.directory
+        )
+    }
+
+
+def print_results(report):
+    from tracing import format_summary
+
+    print(f"commit {report['commit']}  fixtures {report['fixtures']}  "
+          f"raw matches {report['raw_matches']}  stub latency {report['latency_ms']:.0f}ms")
+    for name, result in report['results'].items():
+        print(f"  {name:<20} mean {result['mean_ms']:9.2f}ms  median {result['median_ms']:9.2f}ms  "
+              f"p95 {result['p95_ms']:9.2f}ms  ({result['runs']} runs)")
+    memory = report['memory']
+    print(f"model memory for {memory['matches']} matches: dicts {memory['dict_bytes'] / 1024 ** 2:.1f}MiB, "
+          f"compact {memory['compact_bytes'] / 1024 ** 2:.1f}MiB ({memory['reduction']:.0%} less)")
+    for name, result in report['encodings'].items():
+        print(f"  encode {name:<13} {result['bytes'] / 1024:7.1f}KiB  {result['encode_ms']:7.2f}ms")
+    text_cache = report['text_cache']
+    print(f"text cache: metrics {text_cache['metrics_hit_rate']:.0%} hits, "
+          f"sprites {text_cache['sprite_hit_rate']:.0%} hits")
+    for window in report['stream_memory']:
+        print(f"peak memory for {window['window_matches']} matches per player: "
+              f"fetch {window['fetch_peak_bytes'] / 1024 ** 2:.1f}MiB, "
+              f"stream {window['stream_peak_bytes'] / 1024 ** 2:.1f}MiB")
+    if report['stages']:
+        print('stages')
+        for line in format_summary(report['stages']).splitlines():
+            print(f'  {line}')
+
+
+def compare(old_path, new_path):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+
+    print(f"{old['commit']} -> {new['commit']}")
+    for name in new['results']:
+        if name not in old['results']:
+            print(f"  {name:<20} new")
+            continue
+        before = old['results'][name]['mean_ms']
+        after = new['results'][name]['mean_ms']
+        change = (after - before) / before * 100 if before else 0
+        print(f"  {name:<20} {before:9.2f}ms -> {after:9.2f}ms  {change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fetch, process and render')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--matches', type=int, default=40, help='synthetic matches to generate')
+    parser.add_argument('--history', type=int, default=5000, help='synthetic matches for the memory measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--windows', type=lambda value: [int(part) for part in value.split(',')],
+                        default=[100, 400, 1600], help='synthetic matches per player for the streaming memory runs')
+    parser.add_argument('--latency', type=float, default=0.05, help='stub response latency in seconds')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help='results file, defaults to benchmarks/results/<commit>.json')
+    parser.add_argument('--trace', action='store_true', help='record per-stage timings too')
+    parser.add_argument('--verbose', action='store_true', help="don't hide output from the code under test")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(args.port, directory)
+        args.directory = directory
+        report = asyncio.run(run_benchmarks(args))
+
+    print_results(report)
+
+    output = args.output or os.path.join(RESULTS_PATH, f"{report['commit'] or report['timestamp']}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Saved results to {output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import random
+
+# Generators for STRATZ-shaped GraphQL responses, used when no recorded
+# fixtures are available and to build histories larger than any recording
+
+HERO_SHORT_NAMES = [
+    'antimage', 'axe', 'bane', 'bloodseeker', 'crystal_maiden', 'drow_ranger',
+    'earthshaker', 'juggernaut', 'mirana', 'morphling', 'nevermore', 'phantom_lancer',
+    'puck', 'pudge', 'razor', 'sand_king', 'storm_spirit', 'sven', 'tiny',
+    'vengefulspirit', 'windrunner', 'zuus', 'kunkka', 'lina', 'lion', 'shadow_shaman',
+    'slardar', 'tidehunter', 'witch_doctor', 'lich', 'riki', 'enigma', 'tinker',
+    'sniper', 'necrolyte', 'warlock', 'beastmaster', 'queenofpain', 'venomancer', 'kez'
+]
+
+LANE_OUTCOMES = ['TIE', 'RADIANT_VICTORY', 'RADIANT_STOMP', 'DIRE_VICTORY', 'DIRE_STOMP']
+ROLES = ['CORE', 'LIGHT_SUPPORT', 'HARD_SUPPORT']
+LANES = ['SAFE_LANE', 'MID_LANE', 'OFF_LANE', 'SAFE_LANE', 'OFF_LANE']
+
+# Item IDs used in synthetic matches, the last few are neutral items
+ITEM_IDS = list(range(1, 281))
+NEUTRAL_ITEM_IDS = list(range(281, 321))
+
+
+def synthetic_leads(rng, minutes):
+    # Random walk per minute, like radiantNetworthLeads
+    value = 0
+    leads = []
+    for _ in range(minutes + 1):
+        value += rng.randint(-1500, 1500)
+        leads.append(value)
+    return leads
+
+
+def synthetic_raw_match(match_id, start_datetime, tracked_ids, rng):
+    # One match as returned by the players { matches { ... } } query
+    minutes = rng.randint(20, 90)
+    radiant_tracked = rng.random() < 0.5
+    heroes = rng.sample(range(len(HERO_SHORT_NAMES)), 10)
+
+    # Tracked accounts play together on one side
+    first_slot = 0 if radiant_tracked else 5
+    accounts = {first_slot + i: account_id for i, account_id in enumerate(tracked_ids)}
+
+    players = []
+    for slot in range(10):
+        is_radiant = slot < 5
+        account_id = accounts.get(slot) or rng.randint(10 ** 8, 10 ** 9)
+        hero_index = heroes[slot]
+        players.append({
+            'steamAccount': {
+                'id': account_id,
+                'name': f'Player {account_id % 10000}',
+                'avatar': None,
+                'smurfFlag': 0
+            },
+            'role': ROLES[slot % 3],
+            **{f'item{i}Id': rng.choice(ITEM_IDS + [0]) for i in range(6)},
+            'award': 'NONE',
+            'neutral0Id': rng.choice(NEUTRAL_ITEM_IDS),
+            'isRadiant': is_radiant,
+            'kills': rng.randint(0, 20),
+            'lane': LANES[slot % 5],
+            'deaths': rng.randint(0, 15),
+            'assists': rng.randint(0, 30),
+            'networth': rng.randint(3000, 40000),
+            'hero': {
+                'shortName': HERO_SHORT_NAMES[hero_index],
+                'name': f'npc_dota_hero_{HERO_SHORT_NAMES[hero_index]}',
+                'id': hero_index + 1
+            }
+        })
+
+    return {
+        'midLaneOutcome': rng.choice(LANE_OUTCOMES),
+        'radiantKills': rng.randint(5, 60),
+        'direKills': rng.randint(5, 60),
+        'radiantNetworthLeads': synthetic_leads(rng, minutes),
+        'radiantExperienceLeads': synthetic_leads(rng, minutes),
+        'durationSeconds': minutes * 60 + rng.randint(0, 59),
+        'bottomLaneOutcome': rng.choice(LANE_OUTCOMES),
+        'topLaneOutcome': rng.choice(LANE_OUTCOMES),
+        'averageRank': rng.randint(10, 80),
+        'actualRank': rng.randint(10, 80),
+        'rank': rng.randint(10, 80),
+        'id': match_id,
+        'startDateTime': start_datetime,
+        'didRadiantWin': rng.random() < 0.5,
+        'players': players
+    }
+
+
+def synthetic_players_response(account_ids, matches=40, seed=0, party_ratio=0.7,
+                               start_datetime=1700000000):
+    # Response for players(steamAccountIds:[...]) { matches { ... } }. Party
+    # matches show up under every tracked account that played in them, solo
+    # matches only under one, so some get rejected by process_matches.
+    rng = random.Random(seed)
+    per_account = {account_id: [] for account_id in account_ids}
+    for i in range(matches):
+        if rng.random() < party_ratio and len(account_ids) > 1:
+            tracked = rng.sample(account_ids, rng.randint(2, min(5, len(account_ids))))
+        else:
+            tracked = [rng.choice(account_ids)]
+        match = synthetic_raw_match(8000000000 + i, start_datetime + i * 3000, tracked, rng)
+        for account_id in tracked:
+            per_account[account_id].append(match)
+
+    return {'data': {'players': [
+        {'steamAccountId': account_id, 'matches': list(reversed(per_account[account_id]))}
+        for account_id in account_ids
+    ]}}
+
+
+def synthetic_constants_response(game_version=175):
+    return {'data': {'constants': {
+        'items': [
+            {
+                'id': item_id,
+                'name': f'item_{item_id}',
+                'shortName': f'item_{item_id}',
+                'displayName': f'Item {item_id}',
+                'image': f'item_{item_id}.png',
+                'stat': {'neutralItemTier': 1 if item_id in NEUTRAL_ITEM_IDS else None}
+            }
+            for item_id in ITEM_IDS + NEUTRAL_ITEM_IDS
+        ],
+        'heroes': [
+            {
+                'id': i + 1,
+                'name': f'npc_dota_hero_{short_name}',
+                'shortName': short_name,
+                'displayName': short_name.replace('_', ' ').title()
+            }
+            for i, short_name in enumerate(HERO_SHORT_NAMES)
+        ],
+        'gameVersions': [{'id': game_version, 'name': '7.37'}]
+    }}}
+
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+from scheduler import BACKGROUND
+from queries import execute_one
+
+# Default location of the constants cache, can be overridden with CONSTANTS_PATH
+DEFAULT_CONSTANTS_PATH = 'constants.json'
+
+# Refresh the constants at least this often, even if the game version is unchanged
+DEFAULT_TTL = 24 * 60 * 60
+
+# Base URL of the hero and item images, can be overridden with DOTA_CDN_URL
+DEFAULT_CDN_URL = 'https://cdn.cloudflare.steamstatic.com/apps/dota2/images/dota_react'
+
+CONSTANTS_FIELD = '''constants {
+        items {
+          id,
+          name,
+          shortName,
+          displayName,
+          image,
+          stat {
+            neutralItemTier
+          }
+        }
+        heroes {
+          id,
+          name,
+          shortName,
+          displayName
+        }
+        gameVersions {
+          id,
+          name
+        }
+      }'''
+
+GAME_VERSION_FIELD = '''constants {
+        gameVersions {
+          id
+        }
+      }'''
+
+
+def cdn_url():
+    return os.getenv('DOTA_CDN_URL') or DEFAULT_CDN_URL
+
+
+def latest_game_version(game_versions):
+    ids = [version.get('id') for version in game_versions or [] if version.get('id') is not None]
+    return max(ids) if ids else None
+
+
+class ConstantsCache:
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = path or os.getenv('CONSTANTS_PATH') or DEFAULT_CONSTANTS_PATH
+        self.ttl = ttl
+        self.fetched_at = 0
+        self.game_version = None
+        self.items = {}
+        self.heroes = {}
+        self.neutral_items = {}
+        self.missing_items = set()
+        self.load()
+
+    def load(self):
+        # Read the cache from disk, a missing or broken file leaves it empty
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        self._set(data.get('items', []), data.get('heroes', []), data.get('game_version'), data.get('fetched_at', 0))
+        self.missing_items = set(data.get('missing_items', []))
+        return True
+
+    def save(self):
+        data = {
+            'fetched_at': self.fetched_at,
+            'game_version': self.game_version,
+            'items': list(self.items.values()),
+            'heroes': list(self.heroes.values()),
+            'missing_items': sorted(self.missing_items)
+        }
+        # Write to a temporary file first so a crash never leaves half a cache
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary_path, self.path)
+
+    def _set(self, items, heroes, game_version, fetched_at):
+        # Index everything by ID for constant time lookups
+        self.items = {item['id']: item for item in items if item.get('id') is not None}
+        self.heroes = {hero['id']: hero for hero in heroes if hero.get('id') is not None}
+        self.neutral_items = {
+            item_id: item for item_id, item in self.items.items()
+            if (item.get('stat') or {}).get('neutralItemTier') is not None
+        }
+        self.game_version = game_version
+        self.fetched_at = fetched_at
+        # A new snapshot may know items the previous one didn't
+        self.missing_items = set()
+
+    @property
+    def is_empty(self):
+        return not self.items or not self.heroes
+
+    @property
+    def is_expired(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    async def refresh(self, client, priority=BACKGROUND):
+        # Fetch every constant in one request and persist it
+        data = await execute_one(client, CONSTANTS_FIELD, priority)
+        constants = data.get('data', {}).get('constants') or {}
+        self._set(
+            constants.get('items') or [],
+            constants.get('heroes') or [],
+            latest_game_version(constants.get('gameVersions')),
+            time.time()
+        )
+        self.save()
+
+    async def ensure_fresh(self, client, priority=BACKGROUND):
+        # Refresh when the cache is empty or past its TTL, otherwise only
+        # when a cheap version check shows a new patch. Returns True if the
+        # constants were refetched.
+        if self.is_empty or self.is_expired:
+            await self.refresh(client, priority)
+            return True
+
+        data = await execute_one(client, GAME_VERSION_FIELD, priority)
+        constants = data.get('data', {}).get('constants') or {}
+        game_version = latest_game_version(constants.get('gameVersions'))
+        if game_version is not None and game_version != self.game_version:
+            await self.refresh(client, priority)
+            return True
+        return False
+
+    async def ensure_items(self, client, item_ids, priority=BACKGROUND):
+        # Refetch once if matches reference items we don't know yet, which
+        # happens when a patch adds items before the TTL runs out. IDs the
+        # refetch still doesn't know are remembered and not asked about
+        # again until the constants change, by TTL or a new patch.
+        unknown = {
+            item_id for item_id in item_ids
+            if item_id and item_id not in self.items and item_id not in self.missing_items
+        }
+        if unknown:
+            missing = self.missing_items | unknown
+            await self.refresh(client, priority)
+            self.missing_items = missing - set(self.items)
+            self.save()
+
+    def item(self, item_id):
+        return self.items.get(item_id)
+
+    def item_name(self, item_id):
+        item = self.items.get(item_id)
+        return item and (item.get('displayName') or item.get('name'))
+
+    def item_image_url(self, item_id):
+        item = self.items.get(item_id)
+        if not item or not item.get('shortName'):
+            return None
+        return f"{cdn_url()}/items/{item['shortName']}.png"
+
+    def neutral_item(self, item_id):
+        return self.neutral_items.get(item_id)
+
+    def hero(self, hero_id):
+        return self.heroes.get(hero_id)
+
+    def hero_name(self, hero_id):
+        hero = self.heroes.get(hero_id)
+        return hero and (hero.get('displayName') or hero.get('name'))
+
+    def hero_image_url(self, hero_id):
+        hero = self.heroes.get(hero_id)
+        if not hero or not hero.get('shortName'):
+            return None
+        return f"{cdn_url()}/heroes/{hero['shortName']}.png"
@@ -1,9 +1,42 @@
 from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import requests
 import math
+from images import ImageCache
+from constants import ConstantsCache, cdn_url
+from tracing import stage, LAYOUT, PAINT
+from atlas import ItemAtlas, build_item_atlas
+from glyphs import TextCache
+from models import get_lane_key
 
 font = "assets/fonts/inter_variable.ttf"
 
+# Row height hero portraits are drawn at, cached images are pre-scaled to it
+HERO_IMAGE_HEIGHT = 30
+
+# Size item and neutral item icons are drawn at, the item atlas holds each
+# icon at every one of these sizes
+ITEM_ICON_SIZE = (33, 24)
+ITEM_ICON_SIZES = [ITEM_ICON_SIZE]
+
+# Column width granularity for match tables, see Table
+MATCH_TABLE_WIDTH_STEP = 16
+
+# Table templates (layout plus pre-painted static layer) kept around
+TABLE_TEMPLATE_CACHE_SIZE = 32
+
+# Matches stacked on one image by draw_match_pages, and the space between them
+MATCHES_PER_PAGE = 4
+PAGE_GAP = 12
+
+# Lead graph below the player rows
+GRAPH_HEIGHT = 120
+GRAPH_SMOOTHING = 3
+NETWORTH_COLOR = (230, 170, 0)
+EXPERIENCE_COLOR = (60, 120, 220)
+
 lane_outcomes = [
 'TIE',
 'RADIANT_VICTORY',
@@ -19,12 +52,79 @@ def get_font(size):
         font_size_cache[size] = ImageFont.truetype(font, size)
     return font_size_cache[size]
 
+font_metrics_cache = {}
+
+def get_font_metrics(size):
+    # (ascent, descent) of the font at this size
+    if size not in font_metrics_cache:
+        font_metrics_cache[size] = get_font(size).getmetrics()
+    return font_metrics_cache[size]
+
+text_cache = None
+
+def get_text_cache():
+    global text_cache
+    if text_cache is None:
+        text_cache = TextCache()
+    return text_cache
+
 def get_text_size(text, font):
-    bbox = font.getbbox(text)
+    bbox = get_text_cache().bbox(text, font)
     return (bbox[2] - bbox[0], bbox[3] - bbox[1], bbox[1])
+
+def draw_text(draw, image, position, text, font, fill):
+    # Pastes a cached rasterisation of the text instead of redrawing it
+    get_text_cache().draw_text(draw, image, position, text, font, fill)
     
-def get_image_from_url(url):
-    return Image.open(requests.get(url, stream=True).raw)
+image_cache = None
+
+def get_image_cache():
+    global image_cache
+    if image_cache is None:
+        image_cache = ImageCache(heights=(HERO_IMAGE_HEIGHT,))
+    return image_cache
+    
+def get_image_from_url(url, height=HERO_IMAGE_HEIGHT):
+    # Served from memory or disk after the first download
+    return get_image_cache().get(url, height)
+
+item_atlas = None
+item_atlas_loaded = False
+item_atlas_modified = None
+
+def get_item_atlas():
+    # Loaded from disk once, None until an atlas has been built
+    global item_atlas, item_atlas_loaded, item_atlas_modified
+    if not item_atlas_loaded:
+        # Noted before loading, a save racing with the load is picked up by
+        # the next reload_item_atlas
+        item_atlas_modified = ItemAtlas.modified()
+        item_atlas = ItemAtlas.load()
+        item_atlas_loaded = True
+    return item_atlas
+
+def set_item_atlas(atlas):
+    global item_atlas, item_atlas_loaded, item_atlas_modified
+    item_atlas = atlas
+    item_atlas_loaded = True
+    item_atlas_modified = ItemAtlas.modified()
+
+def reload_item_atlas():
+    # Load the atlas again if another process saved a new one since. One
+    # stat, render workers call it once per job rather than per item.
+    global item_atlas_loaded
+    if item_atlas_loaded and ItemAtlas.modified() != item_atlas_modified:
+        item_atlas_loaded = False
+    return get_item_atlas()
+
+def refresh_item_atlas(constants):
+    # Rebuild the atlas when there is none yet or the game version changed
+    atlas = reload_item_atlas()
+    if atlas is None or atlas.game_version != constants.game_version:
+        atlas = build_item_atlas(constants, get_image_cache(), ITEM_ICON_SIZES)
+        atlas.save()
+        set_item_atlas(atlas)
+    return atlas
 
 def number_shortener(number):
     if number >= 1000000:
@@ -35,20 +135,76 @@ def number_shortener(number):
 
     
 
+class TableLayout:
+    # Result of the measure pass: the size of every row and column and where
+    # each cell goes. Tables with the same structure and sizes share one.
+    def __init__(self, title_size, row_heights, column_widths, spans):
+        self.title_size = title_size
+        self.row_heights = row_heights
+        self.column_widths = column_widths
+        self.width = sum(column_widths)
+        self.height = title_size[1] + sum(row_heights)
+        self.spans = spans
+        self.key = (title_size[1], tuple(row_heights), tuple(column_widths), spans)
+        
+        # (x, y, width, height) of each cell, row by row
+        self.boxes = []
+        y = title_size[1]
+        for row_spans, row_height in zip(spans, row_heights):
+            boxes = []
+            x = 0
+            j = 0
+            for span in row_spans:
+                width = sum(column_widths[j:j + span])
+                boxes.append((x, y, width, row_height))
+                x += width
+                j += span
+            self.boxes.append(boxes)
+            y += row_height
+
+class TableTemplate:
+    # A layout plus its static layer: the background and every static cell
+    # (e.g. the header row) painted once, copied for each table drawn with it
+    def __init__(self, layout, rows):
+        self.layout = layout
+        self.background = Image.new('RGB', (layout.width, layout.height), (255, 255, 255))
+        draw = ImageDraw.Draw(self.background)
+        for row, boxes in zip(rows, layout.boxes):
+            for cell, (x, y, width, height) in zip(row, boxes):
+                if cell.static_key() is not None:
+                    cell.draw(draw, self.background, x, y, width, height)
+
+table_templates = OrderedDict()
+
+def get_table_template(layout, rows):
+    # Static cells are part of the key, so tables only share a template when
+    # their static layer would come out the same
+    key = (layout.key, tuple(tuple(cell.static_key() for cell in row) for row in rows))
+    template = table_templates.get(key)
+    if template is None:
+        template = table_templates[key] = TableTemplate(layout, rows)
+        if len(table_templates) > TABLE_TEMPLATE_CACHE_SIZE:
+            table_templates.popitem(last=False)
+    else:
+        table_templates.move_to_end(key)
+    return template
+
 class Table:
-    def __init__(self, title):
+    def __init__(self, title, width_step=1):
         self.rows = []
         self.title = title
         self.min_row_height = 20
+        # Column widths are rounded up to a multiple of this, so tables with
+        # slightly different content still share a template
+        self.width_step = width_step
         
         
 
     def add_row(self, row):
         self.rows.append(row)
 
-    def draw(self):
-        print('Drawing table')
-        
+    def layout(self):
+        # Measure pass, sizes come from the cells' own measurements
         title_font = get_font(24)
         title_size = get_text_size(self.title, title_font)
         
@@ -58,47 +214,85 @@ class Table:
                 rowHeights[i] = max(rowHeights[i], cell.height)
         
         if self.rows:
-            columnWidths = [0] * len(self.rows[0])
+            columnWidths = [0] * sum(cell.span for cell in self.rows[0])
         else:
             columnWidths = []
         
         for row in self.rows:
-            for i, cell in enumerate(row):
-                columnWidths[i] = max(columnWidths[i], cell.width)
+            i = 0
+            for cell in row:
+                if cell.span == 1:
+                    columnWidths[i] = max(columnWidths[i], cell.width)
+                i += cell.span
+        
+        # Cells spanning several columns widen the last of them if needed
+        for row in self.rows:
+            i = 0
+            for cell in row:
+                if cell.span > 1:
+                    spanned = sum(columnWidths[i:i + cell.span])
+                    if cell.width > spanned:
+                        columnWidths[i + cell.span - 1] += cell.width - spanned
+                i += cell.span
         
-        totalWidth = sum(columnWidths)
-        totalHeight = title_size[1] + sum(rowHeights)
+        step = self.width_step
+        columnWidths = [-(-width // step) * step for width in columnWidths]
         
-        print('Total width:', totalWidth)
-        print('Total height:', totalHeight)
+        spans = tuple(tuple(cell.span for cell in row) for row in self.rows)
+        return TableLayout(title_size, rowHeights, columnWidths, spans)
+
+    def paint(self, template, image=None, top=0):
+        # Paint pass, only the title and the dynamic cells are drawn per table.
+        # Given an image, e.g. a page of several tables, paints onto it at top.
+        layout = template.layout
+        title_font = get_font(24)
+        title_size = get_text_size(self.title, title_font)
         
-        image = Image.new('RGB', (totalWidth, totalHeight), (255, 255, 255))
-        draw = ImageDraw.Draw(image)
+        if image is None:
+            image = template.background.copy()
+        else:
+            image.paste(template.background, (0, top))
         
-        draw.text((0, -title_size[2]), self.title, font=title_font, spacing=0, fill=(0, 0, 0))
+        # The title goes on its own strip so its borders stay clipped to the
+        # title area, the header row used to be painted over them
+        title_image = Image.new('RGB', (layout.width, title_size[1]), (255, 255, 255))
+        title_draw = ImageDraw.Draw(title_image)
+        draw_text(title_draw, title_image, (0, -title_size[2]), self.title, title_font, (0, 0, 0))
         # Draw a red border around the title
-        draw.rectangle([0, 0, title_size[0], title_size[1]], outline=(255, 0, 0))
-        text_bbox = draw.textbbox((0, 0), self.title, font=title_font)
-        draw.rectangle(text_bbox, outline=(0, 255, 0))
-        y = title_size[1]
-        for i, row in enumerate(self.rows):
-            x = 0
-            for j, cell in enumerate(row):
-                image, draw = cell.draw(draw, image, x, y, columnWidths[j], rowHeights[i])
-                x += columnWidths[j]
-            y += rowHeights[i]
-                
+        title_draw.rectangle([0, 0, title_size[0], title_size[1]], outline=(255, 0, 0))
+        text_bbox = get_text_cache().bbox(self.title, title_font)
+        title_draw.rectangle(text_bbox, outline=(0, 255, 0))
+        image.paste(title_image, (0, top))
+        
+        draw = ImageDraw.Draw(image)
+        for row, boxes in zip(self.rows, layout.boxes):
+            for cell, (x, y, width, height) in zip(row, boxes):
+                if cell.static_key() is None:
+                    image, draw = cell.draw(draw, image, x, top + y, width, height)
+        
         return image
+
+    def draw(self):
+        with stage(LAYOUT):
+            template = get_table_template(self.layout(), self.rows)
+        
+        with stage(PAINT):
+            return self.paint(template)
             
         
 class Cell:
     def __init__(self, **kwargs):
         self.width = kwargs.get('width', 0)
         self.height = kwargs.get('height', 0)
+        # Number of table columns the cell covers
+        self.span = kwargs.get('span', 1)
         
-    def draw(self, draw, image, x, y, width, height):
-        print('Drawing cell with width', self.width, 'and height', self.height)
+    def static_key(self):
+        # Cells that look the same in every table return a key describing
+        # them and are painted once into the table template, None otherwise
+        return None
         
+    def draw(self, draw, image, x, y, width, height):
         return image, draw
         
 class HeaderCell(Cell):
@@ -115,28 +309,23 @@ class HeaderCell(Cell):
         if not self.height:
             self.height = self.padding[0] + self.padding[2] + self.text_size[1]
             
+    def static_key(self):
+        return ('header', self.text, self.font_size)
         
     def draw(self, draw, image, x, y, width, height):
-        print('Drawing header cell with text:', self.text)
         # Draw the text in the center of the cell
         # text_x = x + (width - self.text_size[0]) // 2
         # text_y = y + (height - self.text_size[1]) // 2
         
         text_x = int(x + (width / 2) - (self.text_size[0] / 2))
         text_y = int(y + (height / 2) - (self.text_size[1] / 2))
-
-        print(f'x: {x}, y: {y}, width: {width}, height: {height}')        
-        print(f'text_size: {self.text_size}, text_x: {text_x}, text_y: {text_y}')
-        print(f'relative text_x: {text_x - x}, relative text_y: {text_y - y}, text size: {self.text_size}')
-        
-        
         
         # Add background color
         draw.rectangle([x, y, x + width, y + height], fill=(200, 200, 200)) 
         #Draw red outline around text bbox
         # draw.rectangle([text_x, text_y, text_x + self.text_size[0], text_y + self.text_size[1]], outline=(255, 0, 0))
         
-        draw.text((text_x, text_y-self.text_size[2]), self.text, font=self.font, fill=(0, 0, 0))
+        draw_text(draw, image, (text_x, text_y-self.text_size[2]), self.text, self.font, (0, 0, 0))
         
         return image, draw
 
@@ -158,12 +347,10 @@ class TextCell(Cell):
             self.height = self.padding[0] + self.padding[2] + self.text_size[1]
         
     def draw(self, draw, image, x, y, width, height):
-        print('Drawing text cell with text:', self.text)
-        
         text_x = int(x + (width / 2) - (self.text_size[0] / 2))
         text_y = int(y + (height / 2) - (self.text_size[1] / 2))
         
-        draw.text((text_x, text_y-self.text_size[2]), self.text, font=self.font, fill=(0, 0, 0))
+        draw_text(draw, image, (text_x, text_y-self.text_size[2]), self.text, self.font, (0, 0, 0))
         return image, draw
 
         
@@ -173,37 +360,71 @@ class HeroImageCell(Cell):
         self.image = image
         self.image_height = image.height
         self.image_width = image.width
-        self.height = kwargs.get('height', 30)
+        self.height = kwargs.get('height', HERO_IMAGE_HEIGHT)
+        if not self.width:
+            self.width = int(self.height * self.image_width / self.image_height)
         
     def draw(self, draw, image, x, y, width, height):
-        print('Drawing image cell with image:', self.image)
-        # Draw the image in the center of the cell, maintaining aspect ratio
-        aspect_ratio = self.image_width / self.image_height
-        self.image = self.image.resize((int(height * aspect_ratio), height))
-        self.image = self.image.crop((0, 0, width, height))
-        image.paste(self.image, (x, y))
+        # Draw the image in the center of the cell, maintaining aspect ratio.
+        # Cached images already match the row height and skip the resize.
+        hero_image = self.image
+        if hero_image.height != height:
+            aspect_ratio = self.image_width / self.image_height
+            hero_image = hero_image.resize((int(height * aspect_ratio), height))
+        if hero_image.width != width:
+            hero_image = hero_image.crop((0, 0, width, height))
+        image.paste(hero_image, (x, y))
         
         
         return image, draw
 
         
+def draw_item_icon(draw, image, item_id, x, y, size):
+    # Blit the icon from the shared atlas, or an empty slot if there is none
+    atlas = get_item_atlas()
+    if item_id and atlas is not None and atlas.paste(image, item_id, (x, y), size):
+        return
+    draw.rectangle([x, y, x + size[0] - 1, y + size[1] - 1], fill=(230, 230, 230))
+
 class ItemCell(Cell):
-    def __init__(self, item_name, **kwargs):
+    def __init__(self, item_ids, **kwargs):
         super().__init__(**kwargs)
-        self.item_images = []
+        self.item_ids = list(item_ids)
+        self.icon_size = kwargs.get('icon_size', ITEM_ICON_SIZE)
+        self.gap = kwargs.get('gap', 2)
+        self.padding = kwargs.get('padding', [3, 3, 3, 3])
+        
+        slots = len(self.item_ids)
+        if not self.width:
+            self.width = self.padding[1] + self.padding[3] + slots * self.icon_size[0] + max(slots - 1, 0) * self.gap
+        if not self.height:
+            self.height = self.padding[0] + self.padding[2] + self.icon_size[1]
         
     def draw(self, draw, image, x, y, width, height):
-        print('Drawing item cell')
+        icon_x = x + self.padding[3]
+        icon_y = y + (height - self.icon_size[1]) // 2
+        for item_id in self.item_ids:
+            draw_item_icon(draw, image, item_id, icon_x, icon_y, self.icon_size)
+            icon_x += self.icon_size[0] + self.gap
         
         return image, draw
 
 class NeutralItemCell(Cell):
-    def __init__(self, item_name, **kwargs):
+    def __init__(self, item_id, **kwargs):
         super().__init__(**kwargs)
-        self.item_image = None
+        self.item_id = item_id
+        self.icon_size = kwargs.get('icon_size', ITEM_ICON_SIZE)
+        self.padding = kwargs.get('padding', [3, 3, 3, 3])
+        
+        if not self.width:
+            self.width = self.padding[1] + self.padding[3] + self.icon_size[0]
+        if not self.height:
+            self.height = self.padding[0] + self.padding[2] + self.icon_size[1]
         
     def draw(self, draw, image, x, y, width, height):
-        print('Drawing neutral item cell')
+        icon_x = x + (width - self.icon_size[0]) // 2
+        icon_y = y + (height - self.icon_size[1]) // 2
+        draw_item_icon(draw, image, self.item_id, icon_x, icon_y, self.icon_size)
         
         return image, draw
         
@@ -213,37 +434,249 @@ class LaneOutcomeCell(Cell):
         self.outcome = outcome
         self.width = 60
         
-    def draw(self, draw, image, x, y, width, height):
-        print('Drawing lane outcome cell with outcome:', self.outcome)
-        
-        text_x = int(x + (width / 2) - 6)
-        text_y = int(y + (height / 2) - 6)
-        
-        # Calculate text position
-        font = get_font(12)
-        ascent, descent = font.getmetrics()
-        text_height = ascent + descent
-        
         if (lane_outcomes[self.outcome] == 'TIE'):
-            text = 'TIE'
+            self.text = 'TIE'
         elif (lane_outcomes[self.outcome] == 'RADIANT_VICTORY'):
-            text = 'RW'
+            self.text = 'RW'
         elif (lane_outcomes[self.outcome] == 'RADIANT_STOMP'):
-            text = 'RS'
+            self.text = 'RS'
         elif (lane_outcomes[self.outcome] == 'DIRE_VICTORY'):
-            text = 'DW'
+            self.text = 'DW'
         elif (lane_outcomes[self.outcome] == 'DIRE_STOMP'):
-            text = 'DS'
+            self.text = 'DS'
         else:
-            text = ''
+            self.text = ''
+        
+        self.font = get_font(12)
+        self.text_width = get_text_size(self.text, self.font)[0]
         
-        text_width = get_text_size(text, font)[0] 
-        text_x = x + (width - text_width) // 2
+    def draw(self, draw, image, x, y, width, height):
+        # Calculate text position
+        ascent, descent = get_font_metrics(12)
+        text_height = ascent + descent
+        
+        text_x = x + (width - self.text_width) // 2
         text_y = y + (height - text_height) // 2
         
-        draw.text((text_x, text_y), text, font=font, fill=(0, 0, 0))
+        draw_text(draw, image, (text_x, text_y), self.text, self.font, (0, 0, 0))
+        return image, draw
+
+def smooth(values, window):
+    # Centred moving average along the last axis, edges repeat their value
+    if window <= 1:
+        return values
+    before = window // 2
+    padded = np.pad(values, [(0, 0), (before, window - 1 - before)], mode='edge')
+    cumulative = np.cumsum(padded, axis=1)
+    cumulative = np.concatenate([np.zeros((values.shape[0], 1)), cumulative], axis=1)
+    return (cumulative[:, window:] - cumulative[:, :-window]) / window
+
+def lead_graph_points(leads, x, y, width, height, smoothing=GRAPH_SMOOTHING):
+    # leads is a (series, minutes) array. All series share one scale centred
+    # on zero, radiant ahead is up. Returns (series, minutes * 2) interleaved
+    # x, y pixel coordinates, each row ready to hand to ImageDraw.line.
+    leads = smooth(np.asarray(leads, dtype=np.float64), smoothing)
+    minutes = leads.shape[1]
+    scale = np.abs(leads).max() or 1.0
+    points = np.empty((leads.shape[0], minutes * 2))
+    points[:, 0::2] = x + np.linspace(0, width - 1, minutes)
+    points[:, 1::2] = y + (height - 1) / 2 * (1 - leads / scale)
+    return points, scale
+
+def stack_leads(*series):
+    # One (series, minutes) array, shorter series are padded with their last value
+    minutes = max(len(values) for values in series)
+    return np.vstack([
+        np.pad(np.asarray(values, dtype=np.float64), (0, minutes - len(values)), mode='edge')
+        for values in series
+    ])
+
+class LeadGraphCell(Cell):
+    def __init__(self, networth_leads, experience_leads, **kwargs):
+        super().__init__(**kwargs)
+        self.leads = stack_leads(networth_leads, experience_leads)
+        self.colors = [NETWORTH_COLOR, EXPERIENCE_COLOR]
+        self.labels = ['Networth', 'XP']
+        self.smoothing = kwargs.get('smoothing', GRAPH_SMOOTHING)
+        self.padding = kwargs.get('padding', [6, 8, 6, 8])
+        self.font = get_font(12)
+        
+        if not self.width:
+            self.width = 300
+        if not self.height:
+            self.height = GRAPH_HEIGHT
+        
+    def draw(self, draw, image, x, y, width, height):
+        left = x + self.padding[3]
+        top = y + self.padding[0]
+        graph_width = width - self.padding[1] - self.padding[3]
+        graph_height = height - self.padding[0] - self.padding[2]
+        
+        # Zero line and a tick every 10 minutes
+        zero_y = top + (graph_height - 1) // 2
+        draw.line([left, zero_y, left + graph_width - 1, zero_y], fill=(200, 200, 200))
+        minutes = self.leads.shape[1]
+        if minutes < 2:
+            return image, draw
+        for tick_x in np.linspace(left, left + graph_width - 1, minutes)[10::10].tolist():
+            draw.line([tick_x, zero_y - 3, tick_x, zero_y + 3], fill=(200, 200, 200))
+        
+        # Both series scaled and smoothed in one pass, one polyline each
+        points, scale = lead_graph_points(self.leads, left, top, graph_width, graph_height, self.smoothing)
+        for series, color in zip(points, self.colors):
+            draw.line(series.tolist(), fill=color, width=2, joint='curve')
+        
+        draw_text(draw, image, (left, top), f'+{number_shortener(int(scale))}', self.font, (120, 120, 120))
+        bottom_label_y = top + graph_height - get_text_size('0', self.font)[1] - 4
+        draw_text(draw, image, (left, bottom_label_y), f'-{number_shortener(int(scale))}', self.font, (120, 120, 120))
+        label_x = left + graph_width
+        for label, color in reversed(list(zip(self.labels, self.colors))):
+            label_x -= get_text_size(label, self.font)[0] + 8
+            draw_text(draw, image, (label_x, top), label, self.font, color)
         return image, draw
 
+def hero_image_url(short_name):
+    return f"{cdn_url()}/heroes/{short_name}.png"
+
+def load_hero_images(matches, workers=8):
+    # One lookup per distinct hero across all the matches, heroes whose
+    # image can't be loaded map to None
+    urls = {hero_image_url(player['hero']['short_name']) for match in matches for player in match['players']}
+    cache = get_image_cache()
+    
+    def load(url):
+        try:
+            return url, cache.get(url, HERO_IMAGE_HEIGHT)
+        except (requests.RequestException, OSError):
+            return url, None
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(load, urls))
+
+def build_match_table(match, hero_images=None):
+    # Table for one processed match from matches.process_matches. hero_images
+    # from load_hero_images saves looking each hero up again.
+    table = Table(f"Match {match['match_id']}", width_step=MATCH_TABLE_WIDTH_STEP)
+    table.add_row([
+        HeaderCell('Player'),
+        HeaderCell('Hero'),
+        HeaderCell('Kills'),
+        HeaderCell('Deaths'),
+        HeaderCell('Assists'),
+        HeaderCell('Networth'),
+        HeaderCell('Role'),
+        HeaderCell('Lane'),
+        HeaderCell('Items'),
+        HeaderCell('Neutral Item')
+    ])
+    
+    for player in match['players']:
+        hero = player['hero']
+        performance = player['performance']
+        
+        url = hero_image_url(hero['short_name'])
+        if hero_images is not None:
+            hero_image = hero_images.get(url)
+        else:
+            try:
+                hero_image = get_image_from_url(url)
+            except (requests.RequestException, OSError):
+                hero_image = None
+        if hero_image is not None:
+            hero_cell = HeroImageCell(hero_image)
+        else:
+            hero_cell = TextCell(hero['short_name'] or '')
+        
+        lane_key = get_lane_key(performance['lane'], player['is_radiant'])
+        outcome = match['lane_outcomes'].get(lane_key)
+        if outcome in lane_outcomes:
+            lane_cell = LaneOutcomeCell(lane_outcomes.index(outcome))
+        else:
+            lane_cell = TextCell('')
+        
+        table.add_row([
+            TextCell(player['steam_account_name'] or 'Anonymous'),
+            hero_cell,
+            TextCell(str(performance['kills'])),
+            TextCell(str(performance['deaths'])),
+            TextCell(str(performance['assists'])),
+            TextCell(number_shortener(performance['networth'] or 0)),
+            TextCell((performance['role'] or '').replace('_', ' ').title()),
+            lane_cell,
+            ItemCell(player['items']),
+            NeutralItemCell(player['neutral_item'])
+        ])
+    
+    # Lead graph across the whole table once the leads have been loaded
+    networth_leads = match.get('radiant_networth_leads')
+    experience_leads = match.get('radiant_experience_leads')
+    if networth_leads and experience_leads:
+        table.add_row([LeadGraphCell(networth_leads, experience_leads, span=10)])
+    
+    return table
+
+def draw_tables(tables, gap=PAGE_GAP):
+    # Stack several tables on one image. They share one set of column widths,
+    # the widest each column is in any of them, so they line up and tables
+    # with the same rows share a template.
+    with stage(LAYOUT):
+        layouts = [table.layout() for table in tables]
+        column_count = max(len(layout.column_widths) for layout in layouts)
+        widths = [0] * column_count
+        for layout in layouts:
+            for i, width in enumerate(layout.column_widths):
+                widths[i] = max(widths[i], width)
+        
+        templates = []
+        for table, layout in zip(tables, layouts):
+            if len(layout.column_widths) == column_count:
+                layout = TableLayout(layout.title_size, layout.row_heights, widths, layout.spans)
+            templates.append(get_table_template(layout, table.rows))
+        
+        page_width = max(template.layout.width for template in templates)
+        page_height = sum(template.layout.height for template in templates) + gap * (len(tables) - 1)
+    
+    with stage(PAINT):
+        page = Image.new('RGB', (page_width, page_height), (255, 255, 255))
+        y = 0
+        for table, template in zip(tables, templates):
+            table.paint(template, page, y)
+            y += template.layout.height + gap
+    return page
+
+def draw_match_pages(matches, per_page=MATCHES_PER_PAGE, gap=PAGE_GAP):
+    # Several matches on a few images instead of one image each, with one
+    # asset lookup for the whole batch
+    hero_images = load_hero_images(matches)
+    tables = [build_match_table(match, hero_images) for match in matches]
+    return [
+        draw_tables(tables[start:start + per_page], gap)
+        for start in range(0, len(tables), per_page)
+    ]
+
+def prewarm(matches=()):
+    # Load what the first table would otherwise wait for: the portrait of
+    # every hero in the constants snapshot and of the given matches, as far
+    # as they are already on disk. Every worker runs this at once, so it
+    # never downloads, a hero that isn't cached is drawn as its name here.
+    # Returns throwaway drawings, one single table and the pages, to warm the
+    # templates and text sprites.
+    constants = ConstantsCache()
+    matches = list(matches)
+    urls = {hero_image_url(hero['shortName']) for hero in constants.heroes.values() if hero.get('shortName')}
+    urls.update(hero_image_url(player['hero']['short_name']) for match in matches for player in match['players'])
+    hero_images = get_image_cache().load_cached(urls, HERO_IMAGE_HEIGHT)
+
+    if not matches:
+        return []
+    tables = [build_match_table(match, hero_images) for match in matches]
+    images = [tables[0].draw()]
+    images.extend(
+        draw_tables(tables[start:start + MATCHES_PER_PAGE], PAGE_GAP)
+        for start in range(0, len(tables), MATCHES_PER_PAGE)
+    )
+    return images
+
 if __name__ == '__main__':
     # Output test table image
     table = Table('Match 10239581')
@@ -269,14 +702,18 @@ if __name__ == '__main__':
         TextCell(number_shortener(10000)),
         TextCell('Carry'),
         LaneOutcomeCell(1),
-        ItemCell('item1'),
-        NeutralItemCell('neutral item')
+        ItemCell([1, 48, 0, 116, 0, 0]),
+        NeutralItemCell(300)
     ])
     
     image = table.draw()
     
     image.show()
-    image.save('table.png')
+    
+    # Encoded size and time with each of the encodings the bot can use
+    from encoding import compare_encodings
+    for name, result in compare_encodings(image).items():
+        print(f"{name:<12} {result['bytes'] / 1024:7.1f}KiB  {result['encode_ms']:6.1f}ms")
     
     
     # Example usage
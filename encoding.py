@@ -0,0 +1,57 @@
+import io
+import os
+import time
+from tracing import stage, ENCODE
+
+# Ways of encoding a rendered table. Tables are mostly flat colours, so a 256
+# colour palette loses next to nothing and makes the PNG much smaller.
+ENCODINGS = {
+    # Pillow's default zlib level
+    'png': {'format': 'PNG', 'extension': 'png', 'options': {'compress_level': 6}},
+    'png-fast': {'format': 'PNG', 'extension': 'png', 'options': {'compress_level': 1}},
+    'png-palette': {'format': 'PNG', 'extension': 'png', 'options': {'compress_level': 6}, 'palette': True},
+    'webp': {'format': 'WEBP', 'extension': 'webp', 'options': {'lossless': True, 'quality': 50, 'method': 2}}
+}
+
+# Encoding used when none is asked for, can be overridden with IMAGE_ENCODING
+DEFAULT_ENCODING = 'png-palette'
+
+
+def default_encoding():
+    return os.getenv('IMAGE_ENCODING') or DEFAULT_ENCODING
+
+
+def extension(encoding=None):
+    return ENCODINGS[encoding or default_encoding()]['extension']
+
+
+def encode(image, encoding=None):
+    # Encode into memory and return the bytes, nothing touches the disk
+    from PIL import Image  # only the render workers encode, not the bot process
+    settings = ENCODINGS[encoding or default_encoding()]
+    with stage(ENCODE):
+        if settings.get('palette'):
+            image = image.quantize(256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+        buffer = io.BytesIO()
+        image.save(buffer, format=settings['format'], **settings['options'])
+        return buffer.getvalue()
+
+
+def compare_encodings(image, encodings=None, runs=3):
+    # Size and encode time of the image with each encoding
+    results = {}
+    for name in encodings or ENCODINGS:
+        started = time.perf_counter()
+        for _ in range(runs):
+            data = encode(image, name)
+        results[name] = {
+            'bytes': len(data),
+            'encode_ms': (time.perf_counter() - started) / runs * 1000
+        }
+    return results
+
+
+def discord_file(data, name, encoding=None):
+    # Attachment straight from the encoded bytes, e.g. discord_file(data, 'match_123')
+    import discord  # only the bot process needs it, not the render workers
+    return discord.File(io.BytesIO(data), filename=f'{name}.{extension(encoding)}')
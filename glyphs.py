@@ -0,0 +1,96 @@
+from collections import OrderedDict
+
+# Bounded caches for table text. Measuring a string and rasterising it both
+# go through FreeType, and every table draws the same strings over and over:
+# hero and role names, lane labels, headers and small numbers.
+
+# Number of (text, font size) bounding boxes kept
+DEFAULT_METRICS_SIZE = 4096
+
+# Number of rasterised text masks kept
+DEFAULT_SPRITE_SIZE = 1024
+
+COUNTERS = ('metrics_hits', 'metrics_misses', 'sprite_hits', 'sprite_misses')
+
+
+class TextCache:
+    def __init__(self, metrics_size=DEFAULT_METRICS_SIZE, sprite_size=DEFAULT_SPRITE_SIZE, sprites=True):
+        self.metrics_size = metrics_size
+        self.sprite_size = sprite_size
+        # With sprites off text is drawn by FreeType every time as before
+        self.sprites = sprites
+
+        self.metrics_hits = 0
+        self.metrics_misses = 0
+        self.sprite_hits = 0
+        self.sprite_misses = 0
+
+        self._metrics = OrderedDict()
+        self._sprites = OrderedDict()
+
+    def bbox(self, text, font):
+        # font.getbbox(text), keyed by (text, font size) since every size
+        # comes from the same font file
+        key = (text, font.size)
+        bbox = self._metrics.get(key)
+        if bbox is not None:
+            self.metrics_hits += 1
+            self._metrics.move_to_end(key)
+            return bbox
+
+        self.metrics_misses += 1
+        bbox = font.getbbox(text)
+        self._metrics[key] = bbox
+        if len(self._metrics) > self.metrics_size:
+            self._metrics.popitem(last=False)
+        return bbox
+
+    def sprite(self, text, font):
+        # Greyscale coverage mask of the text cropped to its bounding box,
+        # None for text with no visible pixels
+        key = (text, font.size)
+        if key in self._sprites:
+            self.sprite_hits += 1
+            self._sprites.move_to_end(key)
+            return self._sprites[key]
+
+        from PIL import Image, ImageDraw  # keeps importing COUNTERS light
+        self.sprite_misses += 1
+        left, top, right, bottom = self.bbox(text, font)
+        mask = None
+        if right > left and bottom > top:
+            mask = Image.new('L', (right - left, bottom - top), 0)
+            ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+        self._sprites[key] = mask
+        if len(self._sprites) > self.sprite_size:
+            self._sprites.popitem(last=False)
+        return mask
+
+    def draw_text(self, draw, image, position, text, font, fill):
+        # Same result as draw.text(position, text, font=font, fill=fill)
+        if not self.sprites:
+            draw.text(position, text, font=font, fill=fill)
+            return
+
+        mask = self.sprite(text, font)
+        if mask is None:
+            return
+        left, top = self.bbox(text, font)[:2]
+        x = int(position[0]) + left
+        y = int(position[1]) + top
+        image.paste(fill, (x, y, x + mask.width, y + mask.height), mask)
+
+    def stats(self):
+        metrics_total = self.metrics_hits + self.metrics_misses
+        sprite_total = self.sprite_hits + self.sprite_misses
+        stats = {name: getattr(self, name) for name in COUNTERS}
+        stats['metrics_hit_rate'] = self.metrics_hits / metrics_total if metrics_total else 0.0
+        stats['sprite_hit_rate'] = self.sprite_hits / sprite_total if sprite_total else 0.0
+        return stats
+
+    def drain(self):
+        # Counts since the last drain, used to ship a worker's counts back
+        counts = {name: getattr(self, name) for name in COUNTERS}
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        return counts
@@ -0,0 +1,180 @@
+import os
+import io
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import requests
+
+# Default location of the image cache, can be overridden with IMAGE_CACHE_PATH
+DEFAULT_CACHE_PATH = 'cache/images'
+
+# Number of decoded images kept in memory
+DEFAULT_MEMORY_SIZE = 256
+
+
+def write_atomic(path, write, mode='wb'):
+    # Write to a temporary file next to path and move it into place, so
+    # other processes sharing the file never read it half written. The
+    # temporary name is unique, two writers never share it.
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, mode) as file:
+            write(file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+class ImageCache:
+    # Two tier cache of remote images: a small in-memory LRU of decoded images
+    # in front of a content-addressed disk cache. Pre-resized variants are
+    # stored next to each original so drawing never has to resample.
+    def __init__(self, directory=None, memory_size=DEFAULT_MEMORY_SIZE, heights=()):
+        self.directory = directory or os.getenv('IMAGE_CACHE_PATH') or DEFAULT_CACHE_PATH
+        self.memory_size = memory_size
+        self.heights = tuple(heights)
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.downloads = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._index_path = os.path.join(self.directory, 'index.json')
+        self._index = self._load_index()
+
+    def _load_index(self):
+        # url -> sha256 of the downloaded content
+        try:
+            with open(self._index_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        write_atomic(self._index_path, lambda file: json.dump(self._index, file), 'w')
+
+    def _save_image(self, image, path):
+        write_atomic(path, lambda file: image.save(file, format='PNG'))
+
+    def _path(self, digest, height=None):
+        name = digest if height is None else f'{digest}_{height}'
+        return os.path.join(self.directory, f'{name}.png')
+
+    def _remember(self, key, image):
+        with self._lock:
+            self._memory[key] = image
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _open(self, path):
+        image = Image.open(path)
+        # Read the pixels now so the file handle is released
+        image.load()
+        return image
+
+    def _resize(self, image, height):
+        aspect_ratio = image.width / image.height
+        return image.resize((int(height * aspect_ratio), height))
+
+    def _download(self, url):
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        self.downloads += 1
+
+        # Identical content is only stored once, whatever URL it came from
+        original = Image.open(io.BytesIO(content))
+        original.load()
+        if not os.path.exists(self._path(digest)):
+            self._save_image(original, self._path(digest))
+            for height in self.heights:
+                self._save_image(self._resize(original, height), self._path(digest, height))
+
+        with self._lock:
+            self._index[url] = digest
+            self._save_index()
+        return digest, original
+
+    def get(self, url, height=None):
+        # Decoded image for url, resized to height if one is given
+        key = (url, height)
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return image
+            digest = self._index.get(url)
+
+        image = None
+        if digest is not None:
+            variant_path = self._path(digest, height)
+            if os.path.exists(variant_path):
+                image = self._open(variant_path)
+                self.disk_hits += 1
+            elif os.path.exists(self._path(digest)):
+                original = self._open(self._path(digest))
+                self.disk_hits += 1
+                # Keep the new variant so it is only resampled once
+                image = self._resize(original, height)
+                self._save_image(image, variant_path)
+
+        if image is None:
+            digest, image = self._download(url)
+            if height is not None:
+                variant_path = self._path(digest, height)
+                if os.path.exists(variant_path):
+                    image = self._open(variant_path)
+                else:
+                    image = self._resize(image, height)
+                    self._save_image(image, variant_path)
+
+        self._remember(key, image)
+        return image
+
+    def load_cached(self, urls, height=None):
+        # Read the images already on disk into memory, nothing is
+        # downloaded. Returns {url: image} for the ones that were there.
+        loaded = {}
+        for url in urls:
+            with self._lock:
+                digest = self._index.get(url)
+            if digest is None or not os.path.exists(self._path(digest)):
+                continue
+            try:
+                loaded[url] = self.get(url, height)
+            except OSError as e:
+                print(f"Error loading cached image {url}: {e}")
+        return loaded
+
+    def prefetch(self, urls, heights=None, workers=8):
+        # Warm the cache for every url at every height, returns the number of
+        # images that could not be fetched
+        heights = self.heights if heights is None else heights
+        jobs = [(url, height) for url in urls if url for height in heights or (None,)]
+
+        def warm(job):
+            try:
+                self.get(*job)
+                return 0
+            except (requests.RequestException, OSError) as e:
+                print(f"Error prefetching image {job[0]}: {e}")
+                return 1
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(warm, jobs))
+
+    def prefetch_heroes(self, constants, heights=None, workers=8):
+        # Warm every hero portrait in the constants cache
+        urls = [constants.hero_image_url(hero_id) for hero_id in constants.heroes]
+        return self.prefetch(urls, heights, workers)
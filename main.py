@@ -1,15 +1,145 @@
 import discord
 import os # default module
+import time
+import asyncio
+import threading
+import logging
+import aiohttp
 from dotenv import load_dotenv
-from mathces import get_dota_matches
+from matches import (
+    STEAM_ACCOUNT_IDS, fetch_changed_matches_async, get_match_async, load_match_details_async, create_client,
+    get_tracking
+)
+from scheduler import INTERACTIVE
+from store import MatchStore
+from constants import ConstantsCache
+from render import RenderService, RenderQueueFull
+from singleflight import RenderCache, SingleFlight
+from encoding import default_encoding, discord_file
+from poller import MatchPoller
+from stats import DEFAULT_DAYS, account_names, stats_report
+import tracing
 
-load_dotenv() # load all the variables from the env file
 bot = discord.Bot()
 
+# Matches /recent shows by default, and at most
+RECENT_MATCHES = 5
+MAX_RECENT_MATCHES = 20
+
+# Recent matches each render worker draws once while the bot connects, so
+# the first one a user asks for is drawn as fast as any later one
+PREWARM_MATCHES = 4
+
+# Shared by every command: one API client, the match store, the game
+# constants, the render workers and the rendered images, keyed by what was
+# rendered and how. The ones that need the environment are made by start(),
+# importing this module sets nothing up.
+client = None
+store = None
+constants = None
+renderer = None
+render_cache = RenderCache()
+
+# Concurrent /recent calls and the poller share one fetch of new matches
+refreshes = SingleFlight()
+
+# Channel the default accounts' party matches are posted to. Guilds pick
+# their own with /matchchannel, nothing is posted without one.
+MATCH_CHANNEL_ID = None
+
+poller = None
+hero_prefetch = None
+
+def start():
+    global client, store, constants, renderer, MATCH_CHANNEL_ID
+    load_dotenv() # load all the variables from the env file
+    client = create_client()
+    store = MatchStore()
+    # Read from the local snapshot, the poller refreshes it from its first
+    # cycle on
+    constants = ConstantsCache()
+    renderer = RenderService()
+    MATCH_CHANNEL_ID = os.getenv('MATCH_CHANNEL_ID')
+
+    # Stage timings are recorded when this is DEBUG
+    logging.getLogger('trace').setLevel(os.getenv('TRACE_LOG_LEVEL') or 'WARNING')
+
+    # The render workers start warming up in the background straight away,
+    # logging in doesn't wait for them
+    started = time.perf_counter()
+    renderer.start(store.get_matches(limit=PREWARM_MATCHES))
+
+    def report_warm():
+        try:
+            renderer.wait_ready()
+            print(f"Render workers warmed up in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            print(f"Error warming up render workers: {e}")
+
+    threading.Thread(target=report_warm, daemon=True).start()
+
+def guild_accounts(guild_id):
+    # Accounts a guild tracks, the default ones until it adds its own
+    return store.get_tracked_accounts().get(guild_id) or STEAM_ACCOUNT_IDS
+
+def match_channels():
+    # {channel id: accounts whose matches it gets}, read every poll so
+    # changes made with the commands below apply straight away
+    channels = {}
+    if MATCH_CHANNEL_ID:
+        channels[int(MATCH_CHANNEL_ID)] = STEAM_ACCOUNT_IDS
+    tracked = store.get_tracked_accounts()
+    for guild_id, channel_id in store.get_match_channels().items():
+        channels[channel_id] = tracked.get(guild_id) or STEAM_ACCOUNT_IDS
+    return channels
+
+async def prefetch_hero_images():
+    try:
+        failed = await renderer.prefetch_hero_images()
+    except Exception as e:
+        print(f"Error prefetching hero images: {e}")
+        return
+    if failed:
+        print(f"Couldn't fetch {failed} hero images")
+
+async def constants_changed():
+    # Everything built from the constants is brought up to date in the
+    # render workers. The item atlas is a no-op unless the game version
+    # changed since it was built.
+    global hero_prefetch
+    version = await renderer.update_item_atlas()
+    print(f"Item atlas is for game version {version}")
+
+    # The hero portraits are fetched in the background, from then on renders
+    # and the workers' warm-up find them on disk
+    if hero_prefetch is None or hero_prefetch.done():
+        hero_prefetch = asyncio.create_task(prefetch_hero_images())
+
+async def post_pages(channel_id, pages, encoding):
+    channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+    files = [discord_file(page, f'matches_{i + 1}', encoding) for i, page in enumerate(pages)]
+    with tracing.stage(tracing.DISCORD_UPLOAD):
+        await channel.send(files=files)
+
 @bot.event
 async def on_ready():
     print(f"{bot.user} is ready and online!")
 
+    # on_ready fires again after reconnects, only start polling once. Its
+    # first cycle runs straight away and brings the constants up to date,
+    # matches aren't fetched while no channel is set up.
+    global poller
+    if poller is None:
+        poller = MatchPoller(
+            client, store, renderer, post_pages, match_channels,
+            fetch=lambda: refreshes.run(
+                'fetch', lambda: fetch_changed_matches_async(client, store, constants=constants)
+            ),
+            constants=constants,
+            constants_changed=constants_changed
+        )
+        poller.start()
+
 @bot.slash_command(name="hello", description="Say hello to the bot")
 async def hello(ctx: discord.ApplicationContext):
     embed = discord.Embed(
@@ -29,6 +159,153 @@ async def hello(ctx: discord.ApplicationContext):
     embed.set_author(name="Pycord Team", icon_url="https://example.com/link-to-my-image.png")
     embed.set_thumbnail(url="https://example.com/link-to-my-thumbnail.png")
     embed.set_image(url="https://example.com/link-to-my-banner.png")
-    await ctx.respond("Hey!", embed=embed)
+    with tracing.stage(tracing.DISCORD_UPLOAD):
+        await ctx.respond("Hey!", embed=embed)
+
+@bot.slash_command(name="match", description="Show a match")
+async def match(ctx: discord.ApplicationContext, match_id: discord.Option(int, "Match ID")):
+    # Fetching and rendering can take longer than Discord waits for a reply
+    await ctx.defer()
+    encoding = default_encoding()
+    key = ('match', match_id, encoding)
+
+    async def render():
+        found = await get_match_async(client, match_id, store)
+        if found is None:
+            return None
+        return await renderer.render(found, encoding)
+
+    try:
+        data = await render_cache.get(key, render)
+    except RenderQueueFull:
+        await ctx.respond("Too many matches are being drawn right now, try again in a moment")
+        return
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error fetching match {match_id}: {e}")
+        await ctx.respond(f"Couldn't fetch match {match_id}, try again later")
+        return
+
+    if data is None:
+        # Don't remember misses, the match may just not be parsed yet
+        render_cache.discard(key)
+        await ctx.respond(f"Match {match_id} not found")
+        return
+
+    with tracing.stage(tracing.DISCORD_UPLOAD):
+        await ctx.respond(file=discord_file(data, f'match_{match_id}', encoding))
+
+@bot.slash_command(name="recent", description="Show our most recent party matches")
+async def recent(
+    ctx: discord.ApplicationContext,
+    count: discord.Option(int, "Number of matches", min_value=1, max_value=MAX_RECENT_MATCHES, default=RECENT_MATCHES)
+):
+    await ctx.defer()
+    encoding = default_encoding()
+
+    try:
+        await refreshes.run(
+            'fetch', lambda: fetch_changed_matches_async(client, store, priority=INTERACTIVE, constants=constants)
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Still show what is already stored
+        print(f"Error fetching recent matches: {e}")
+
+    recent_matches = store.get_matches(limit=count, account_ids=guild_accounts(ctx.guild_id))
+    if not recent_matches:
+        await ctx.respond("No party matches found")
+        return
+
+    async def render():
+        await load_match_details_async(client, recent_matches, store, INTERACTIVE)
+        return await renderer.render_batch(recent_matches, encoding)
+
+    # The same matches rendered the same way are only drawn once
+    key = ('recent', tuple(recent_match.match_id for recent_match in recent_matches), encoding)
+    try:
+        pages = await render_cache.get(key, render)
+    except RenderQueueFull:
+        await ctx.respond("Too many matches are being drawn right now, try again in a moment")
+        return
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error fetching match details: {e}")
+        await ctx.respond("Couldn't fetch the match details, try again later")
+        return
+
+    files = [discord_file(page, f'recent_{i + 1}', encoding) for i, page in enumerate(pages)]
+    with tracing.stage(tracing.DISCORD_UPLOAD):
+        await ctx.respond(files=files)
+
+@bot.slash_command(name="stats", description="Show our stats over the last days")
+async def stats(
+    ctx: discord.ApplicationContext,
+    days: discord.Option(int, "Number of days", min_value=1, max_value=365, default=DEFAULT_DAYS),
+    hero: discord.Option(str, "Hero, e.g. lina", required=False, default=None),
+    account: discord.Option(int, "Steam account id", required=False, default=None)
+):
+    # Read from the aggregates the store keeps up to date as matches come
+    # in, nothing is fetched or rescanned. The guild's players are counted
+    # in their party matches for any guild, see stats.py.
+    report = stats_report(store, days, hero, account, account_ids=guild_accounts(ctx.guild_id))
+    if report is None:
+        await ctx.respond("No party matches in that period")
+        return
+    await ctx.respond(f"```\n{report}\n```")
+
+@bot.slash_command(name="track", description="Track a player's party matches in this server")
+@discord.guild_only()
+@discord.default_permissions(manage_guild=True)
+async def track(ctx: discord.ApplicationContext, account: discord.Option(int, "Steam account id")):
+    # The next poll fetches the account along with everyone else's, the
+    # matches already stored are looked at again straight away
+    if store.track_account(ctx.guild_id, account):
+        store.match_tracked_accounts(account, get_tracking(store))
+        await ctx.respond(f"Tracking {account}")
+    else:
+        await ctx.respond(f"{account} is already tracked")
+
+@bot.slash_command(name="untrack", description="Stop tracking a player in this server")
+@discord.guild_only()
+@discord.default_permissions(manage_guild=True)
+async def untrack(ctx: discord.ApplicationContext, account: discord.Option(int, "Steam account id")):
+    if store.untrack_account(ctx.guild_id, account):
+        await ctx.respond(f"Stopped tracking {account}")
+    else:
+        await ctx.respond(f"{account} isn't tracked here")
+
+@bot.slash_command(name="tracked", description="Show the players tracked in this server")
+async def tracked(ctx: discord.ApplicationContext):
+    own = store.get_tracked_accounts().get(ctx.guild_id)
+    account_ids = own or STEAM_ACCOUNT_IDS
+    names = account_names(store, account_ids)
+    lines = [f"{names.get(account_id) or 'Unknown'} ({account_id})" for account_id in account_ids]
+    if not own:
+        lines.append("These are the defaults, /track adds this server's own players")
+    await ctx.respond("\n".join(lines))
+
+@bot.slash_command(name="matchchannel", description="Post new party matches to this channel")
+@discord.guild_only()
+@discord.default_permissions(manage_guild=True)
+async def matchchannel(
+    ctx: discord.ApplicationContext,
+    enabled: discord.Option(bool, "Post here, or stop posting", default=True)
+):
+    store.set_match_channel(ctx.guild_id, ctx.channel_id if enabled else None)
+    if enabled:
+        await ctx.respond("New party matches will be posted here")
+    else:
+        await ctx.respond("Stopped posting new party matches")
+
+@bot.slash_command(name="timings", description="Show pipeline stage timings")
+async def timings(ctx: discord.ApplicationContext):
+    if not tracing.enabled():
+        await ctx.respond("Stage timings are off, set TRACE_LOG_LEVEL=DEBUG to record them", ephemeral=True)
+        return
+    await ctx.respond(f"```\n{tracing.format_summary()}\n```", ephemeral=True)
 
-bot.run(os.getenv('DISCORD_TOKEN')) # run the bot with the token
\ No newline at end of file
+if __name__ == '__main__':
+    start()
+    bot.run(os.getenv('DISCORD_TOKEN')) # run the bot with the token
+    if poller is not None:
+        poller.stop()
+    renderer.close()
+    store.close()
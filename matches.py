@@ -1,247 +1,498 @@
 import os
-import requests
+import sys
+import asyncio
+import aiohttp
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from stratz import StratzClient, DEFAULT_CONCURRENCY
+from scheduler import BACKGROUND, INTERACTIVE
+from queries import (
+    PLAYERS_PER_BATCH, FIELDS_PER_REQUEST, batch_accounts, build_selection, build_document,
+    players_field, match_field, execute, execute_one
+)
+from store import MatchStore
+from models import Match
+from streaming import MatchStream, parse_matches_async
+from tracking import Tracking, DEFAULT_GROUP
+from tracing import timed, PROCESS_MATCHES
 
-# Load environment variables from a .env file
-load_dotenv()
-
-# List of Steam Account IDs to track
+# List of Steam Account IDs to track, for guilds that haven't picked their own
 STEAM_ACCOUNT_IDS = [81030588, 129300751, 104889569, 104458277, 119734677, 128463449]
 
-# Get API endpoint and key from environment variables
-API_ENDPOINT = os.getenv('DOTA_API_ENDPOINT')
-API_KEY = os.getenv('DOTA_API_KEY')
+# Window fetched when an account has no high-water mark yet, and the furthest
+# back an incremental poll will reach after downtime
+BACKFILL_WINDOW = timedelta(days=2)
+
+# Matches held back before being written to the store when streaming
+STREAM_SAVE_CHUNK = 50
+
+# Player fields process_matches reads
+PLAYER_FIELDS = (
+    ('steamAccount', ('id', 'name')),
+    'isRadiant',
+    ('hero', ('id', 'shortName', 'name')),
+    'kills',
+    'deaths',
+    'assists',
+    'networth',
+    'lane',
+    'role',
+    'item0Id',
+    'item1Id',
+    'item2Id',
+    'item3Id',
+    'item4Id',
+    'item5Id',
+    'neutral0Id'
+)
+
+# Light fields needed to summarise a match, this is what polling fetches.
+# id comes first so streaming consumers can skip known matches early.
+SUMMARY_FIELDS = (
+    'id',
+    'startDateTime',
+    'didRadiantWin',
+    'durationSeconds',
+    'averageRank',
+    'radiantKills',
+    'direKills',
+    'midLaneOutcome',
+    'bottomLaneOutcome',
+    'topLaneOutcome',
+    ('players', PLAYER_FIELDS)
+)
+
+# Per-minute arrays, only fetched when something needs them (e.g. a graph)
+DETAIL_FIELDS = (
+    'id',
+    'radiantNetworthLeads',
+    'radiantExperienceLeads'
+)
+
+# Everything a single match is rendered from
+MATCH_FIELDS = SUMMARY_FIELDS + DETAIL_FIELDS[1:]
+
+# What the change detection probe asks for, the newest match per account
+LATEST_MATCH_FIELDS = ('id', 'startDateTime')
+
+
+async def get_latest_match_ids_async(client, account_ids=None, priority=BACKGROUND, batch_size=PLAYERS_PER_BATCH):
+    # Newest party match of every account as {account_id: (match_id,
+    # start_datetime)}, None for accounts without any. One players(...)
+    # field per batch, all packed into as few requests as possible, so
+    # usually a single small request. Accounts of failed batches are left
+    # out, so they can't be mistaken for accounts that haven't played.
+    if account_ids is None:
+        account_ids = get_tracking().account_ids
+    batches = batch_accounts(account_ids, batch_size)
+    fields = [
+        players_field(batch, {'isParty': True, 'limit': 1}, build_selection(LATEST_MATCH_FIELDS), ('steamAccountId',))
+        for batch in batches
+    ]
+    results = await execute(client, fields, priority=priority)
+
+    latest = {}
+    for current_batch, data in zip(batches, results):
+        if isinstance(data, Exception):
+            print(f"Error fetching match IDs for batch {current_batch}: {data}")
+            continue
+
+        # An error on the field, or no players at all, fails the batch like
+        # a failed request rather than reading as nobody having played
+        players = data.get('data', {}).get('players')
+        if data.get('errors') or players is None:
+            print(f"Error fetching match IDs for batch {current_batch}: {data.get('errors')}")
+            continue
+
+        # Players come back in the order they were asked for, the id they
+        # carry is used when it's there
+        for position, player in enumerate(players):
+            if not player:
+                continue
+            account_id = player.get('steamAccountId')
+            if account_id is None:
+                if position >= len(current_batch):
+                    continue
+                account_id = current_batch[position]
+            matches = player.get('matches') or []
+            latest[account_id] = (matches[0].get('id'), matches[0].get('startDateTime')) if matches else None
+
+        # Accounts the answer skipped have nothing to show
+        for account_id in current_batch:
+            latest.setdefault(account_id, None)
+
+    return latest
 
-# Check if API credentials are set
-if not API_ENDPOINT or not API_KEY:
-    raise ValueError("Please set DOTA_API_ENDPOINT and DOTA_API_KEY in your .env file")
 
 def get_latest_match_ids():
-    # Prepare headers
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {API_KEY}',
-        'User-Agent': 'STRATZ_API'
+    return run_with_client(get_latest_match_ids_async)
+
+
+def changed_accounts(latest, watermarks, start_timestamp):
+    # Accounts whose newest party match is newer than everything already
+    # fetched for them. The watermark only moves once a fetch got the
+    # account's matches, so a failed fetch is retried on the next probe.
+    # Matches from before the backfill window would never be fetched, so
+    # they don't count as a change.
+    changed = []
+    for account_id, newest in latest.items():
+        if newest is None or newest[1] is None:
+            continue
+        if newest[1] >= start_timestamp and newest[1] > watermarks.get(account_id, 0):
+            changed.append(account_id)
+    return changed
+
+
+def get_tracking(store=None):
+    # The default accounts plus every guild's own, as stored
+    groups = {DEFAULT_GROUP: STEAM_ACCOUNT_IDS}
+    if store is not None:
+        groups.update(store.get_tracked_accounts())
+    return Tracking(groups)
+
+
+def matches_field(account_ids, start_timestamp, end_timestamp, fields=SUMMARY_FIELDS):
+    # fields is the declaration of what the consumer needs from each match
+    return players_field(
+        account_ids,
+        {'isParty': True, 'endDateTime': end_timestamp, 'startDateTime': start_timestamp},
+        build_selection(fields)
+    )
+
+
+async def load_match_details_async(client, matches, store=None, priority=BACKGROUND):
+    # Fetch the heavy per-minute fields for the matches that don't have them
+    # yet, all in as few requests as possible, and attach them in place
+    missing = [match for match in matches if not match.has_details]
+    if not missing:
+        return matches
+
+    selection = build_selection(DETAIL_FIELDS, '        ')
+    results = await execute(client, [match_field(match.match_id, selection) for match in missing], priority=priority)
+
+    loaded = []
+    for match, data in zip(missing, results):
+        if isinstance(data, Exception):
+            print(f"Error fetching details for match {match.match_id}: {data}")
+            continue
+        details = data.get('data', {}).get('match')
+        if data.get('errors') or details is None:
+            # Tried again next time, a passing error mustn't stick
+            print(f"Error fetching details for match {match.match_id}: {data.get('errors')}")
+            continue
+        # STRATZ has no leads for some matches, e.g. unparsed ones. They are
+        # kept as empty so the match counts as loaded and isn't asked for
+        # again on every render.
+        match.set_details(details.get('radiantNetworthLeads') or [], details.get('radiantExperienceLeads') or [])
+        loaded.append(match)
+
+    if store is not None and loaded:
+        store.save_matches(loaded, replace=True)
+
+    return matches
+
+
+def api_credentials():
+    # Read when a client is made rather than at import, so importing this
+    # module works without a configured environment
+    api_endpoint = os.getenv('DOTA_API_ENDPOINT')
+    api_key = os.getenv('DOTA_API_KEY')
+
+    # Check if API credentials are set
+    if not api_endpoint or not api_key:
+        raise ValueError("Please set DOTA_API_ENDPOINT and DOTA_API_KEY in your .env file")
+    return api_endpoint, api_key
+
+
+def create_client(concurrency=DEFAULT_CONCURRENCY):
+    api_endpoint, api_key = api_credentials()
+    return StratzClient(api_endpoint, api_key, concurrency=concurrency)
+
+
+def plan_batches(account_ids, default_start, watermarks=None, batch_size=PLAYERS_PER_BATCH):
+    # Without high-water marks every batch uses the full window
+    if not watermarks:
+        return [(batch, default_start) for batch in batch_accounts(account_ids, batch_size)]
+
+    # Each account only needs matches newer than its high-water mark, but
+    # never further back than the backfill window
+    starts = {
+        account_id: max(watermarks.get(account_id, default_start - 1) + 1, default_start)
+        for account_id in account_ids
     }
- 
-    for i in range(0, len(STEAM_ACCOUNT_IDS), 5):
-        # Take a slice of 5 IDs (or fewer for the last batch)
-        current_batch = STEAM_ACCOUNT_IDS[i:i+5]
-        
-        # Convert Steam Account IDs to string for the query
-        ids_string = ','.join(map(str, current_batch))
-        
-        # GraphQL query
-        query = '''
-        {
-          players(steamAccountIds:[%s]) {
-            matches(request:{
-              isParty: true,
-              limit: 1
-            }) {
-              id
-            }
-          }
-        }
-        ''' % ids_string
-        
-        # Prepare payload
-        payload = {
-            'query': query
-        }
-        
-        try:
-            # Make the API request
-            response = requests.post(API_ENDPOINT, json=payload, headers=headers)
-            
-            # Raise an exception for bad responses
-            response.raise_for_status()
-            
-            # Parse the JSON response
-            data = response.json()
-            
-            # Process matches for this batch
-            match_ids = [
-                match.get('id')
-                for player in data.get('data', {}).get('players', [])
-                for match in player.get('matches', [])
-            ]
-            
-            # Return the list of match IDs
-            return match_ids
-        
-        except requests.RequestException as e:
-            print(f"Error fetching match IDs for batch {current_batch}: {e}")
- 
-                
-
-def fetch_dota_matches():
-    # Calculate the timestamp for 24 hours ago
-    end_time = datetime.utcnow()
-    start_time = end_time - timedelta(days=2)
+
+    # Group accounts with similar marks so a batch's shared start time
+    # doesn't drag the others back
+    ordered = sorted(account_ids, key=lambda account_id: starts[account_id])
+    return [
+        (batch, min(starts[account_id] for account_id in batch))
+        for batch in batch_accounts(ordered, batch_size)
+    ]
+
+
+def collect_watermarks(response_data, account_ids, watermarks):
+    # Record the newest match start time seen for each tracked account,
+    # including matches that process_matches later rejects
+    tracked = set(account_ids)
+    for player in response_data.get('data', {}).get('players') or []:
+        for match in player.get('matches', []):
+            start_datetime = match.get('startDateTime')
+            if start_datetime is None:
+                continue
+            for player_detail in match.get('players', []):
+                account_id = player_detail.get('steamAccount', {}).get('id')
+                if account_id in tracked:
+                    watermarks[account_id] = max(watermarks.get(account_id, 0), start_datetime)
+    return watermarks
+
+
+async def get_match_async(client, match_id, store=None, priority=INTERACTIVE, tracking=None):
+    # One match with its details, from the store when it is there. Returns
+    # None when STRATZ doesn't know the match.
+    match = store.get_match(match_id) if store is not None else None
+    if match is not None:
+        await load_match_details_async(client, [match], store, priority)
+        return match
+
+    data = await execute_one(client, match_field(match_id, build_selection(MATCH_FIELDS, '        ')), priority)
+    match = data.get('data', {}).get('match')
+    if not match:
+        return None
+
+    # Any match can be looked up, only party matches of ours are stored
+    if tracking is None:
+        tracking = get_tracking(store)
+    matching_accounts = tracking.matching_accounts(
+        player_detail.get('steamAccount', {}).get('id')
+        for player_detail in match.get('players', [])
+    )
+    match = Match.from_response(match, matching_accounts)
+    if store is not None and matching_accounts:
+        store.save_matches([match])
+    return match
+
+
+def plan_fetch(account_ids, store, backfill, batch_size, fields):
+    # Calculate the start of the backfill window
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - backfill
     
     # Convert to Unix timestamp (seconds since epoch)
     end_timestamp = int(end_time.timestamp())
     start_timestamp = int(start_time.timestamp())
 
-    # Process matches in batches of 5 Steam IDs
+    # In incremental mode only ask for matches newer than what we've seen
+    watermarks = store.get_watermarks(account_ids) if store is not None else None
+
+    # Split Steam Account IDs into batches
+    batches = plan_batches(account_ids, start_timestamp, watermarks, batch_size)
+    return batches, [
+        matches_field(batch, batch_start, end_timestamp, fields)
+        for batch, batch_start in batches
+    ]
+
+
+async def fetch_dota_matches_async(client, account_ids=None, store=None, backfill=BACKFILL_WINDOW,
+                                   priority=BACKGROUND, batch_size=PLAYERS_PER_BATCH, constants=None,
+                                   fields=SUMMARY_FIELDS, tracking=None):
+    # Every guild's accounts are fetched together, each distinct account
+    # once, and a match is kept if it is a party match for any guild.
+    if tracking is None:
+        tracking = get_tracking(store)
+    if account_ids is None:
+        account_ids = tracking.account_ids
+
+    batches, fields = plan_fetch(account_ids, store, backfill, batch_size, fields)
+
+    # Batches are packed into aliased documents and sent concurrently, the
+    # client limits how many are in flight
+    responses = await execute(client, fields, priority=priority)
+
+    # Process matches in batch order so the results are deterministic
     all_processed_matches = []
     processed_match_ids = set()
     items = set()
+    new_watermarks = {}
+
+    for (current_batch, _), data in zip(batches, responses):
+        if isinstance(data, Exception):
+            print(f"Error fetching matches for batch {current_batch}: {data}")
+            continue
 
-    # Split Steam Account IDs into batches of 5
-    for i in range(0, len(STEAM_ACCOUNT_IDS), 5):
-        # Take a slice of 5 IDs (or fewer for the last batch)
-        current_batch = STEAM_ACCOUNT_IDS[i:i+5]
+        # Process matches for this batch
+        batch_matches = process_matches(data, processed_match_ids, store, tracking)
+        collect_watermarks(data, current_batch, new_watermarks)
         
-        # Convert Steam Account IDs to string for the query
-        ids_string = ','.join(map(str, current_batch))
-
-        # GraphQL query
-        query = '''
-        {
-          players(steamAccountIds:[%s]) {
-            matches(request:{
-              isParty: true,
-              endDateTime: %d,
-              startDateTime: %d
-            }) {
-              midLaneOutcome,
-              radiantKills,
-              direKills,
-              radiantNetworthLeads,
-              radiantExperienceLeads,
-              durationSeconds,
-              bottomLaneOutcome,
-              topLaneOutcome,
-              averageRank,
-              actualRank,
-              rank,
-              id,
-              startDateTime,
-              didRadiantWin,
-              players {
-                steamAccount {
-                  id,
-                  name,
-                  avatar,
-                  smurfFlag
-                }
-                role,
-                item0Id,
-                item1Id,
-                item2Id,
-                item3Id,
-                item4Id,
-                item5Id,
-                award,
-                neutral0Id,
-                isRadiant,
-                kills,
-                lane,
-                deaths,
-                assists,
-                networth
-                hero {
-                  shortName,
-                  name,
-                  id,
-                }
-              }  
-            }
-          }
-        }
-        ''' % (ids_string, end_timestamp, start_timestamp)
+        # Add new unique matches to the overall list
+        all_processed_matches.extend(batch_matches)
+        for match in batch_matches:
+            items.update(item for item in match.items if item > 0)
+            items.update(item for item in match.neutral_items if item > 0)
 
-        # Prepare headers
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {API_KEY}',
-            'User-Agent': 'STRATZ_API'
+    # Make sure every item in these matches can be resolved locally, so
+    # rendering them never has to fetch constants
+    if constants is not None:
+        try:
+            await constants.ensure_items(client, items, priority)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error refreshing constants: {e}")
 
-        }
+    if store is not None:
+        store.save_matches(all_processed_matches)
 
-        # Prepare payload
-        payload = {
-            'query': query
-        }
+        # Failed batches keep their old marks and are retried next poll
+        if new_watermarks:
+            store.update_watermarks(new_watermarks)
+
+    return all_processed_matches
+
+
+async def fetch_changed_matches_async(client, store, backfill=BACKFILL_WINDOW, priority=BACKGROUND,
+                                     constants=None, fields=SUMMARY_FIELDS, tracking=None):
+    # Incremental fetch behind a cheap probe: the newest party match of
+    # every account first, then the full fetch only for the accounts where
+    # that changed. Nothing else is requested while nobody has played.
+    if tracking is None:
+        tracking = get_tracking(store)
+
+    latest = await get_latest_match_ids_async(client, tracking.account_ids, priority)
+    start_timestamp = int((datetime.now(timezone.utc) - backfill).timestamp())
+    changed = changed_accounts(latest, store.get_watermarks(latest), start_timestamp)
+
+    # Accounts whose probe failed are fetched in full rather than taken as
+    # quiet, so an outage of the probe doesn't hide new matches
+    changed.extend(account_id for account_id in tracking.account_ids if account_id not in latest)
+    if not changed:
+        return []
 
+    # Matches are still judged against every guild's accounts, the players
+    # who didn't change just aren't asked for
+    return await fetch_dota_matches_async(
+        client, changed, store, backfill, priority, constants=constants, fields=fields, tracking=tracking
+    )
+
+
+async def stream_dota_matches_async(client, account_ids=None, store=None, backfill=BACKFILL_WINDOW,
+                                    priority=BACKGROUND, batch_size=PLAYERS_PER_BATCH, fields=SUMMARY_FIELDS,
+                                    tracking=None):
+    # Streaming form of fetch_dota_matches_async for wide windows. Responses
+    # are parsed as they arrive and accepted matches are yielded one at a
+    # time, so memory stays flat however many matches come back. Documents
+    # are streamed one after another rather than concurrently.
+    if tracking is None:
+        tracking = get_tracking(store)
+    if account_ids is None:
+        account_ids = tracking.account_ids
+
+    batches, batch_fields = plan_fetch(account_ids, store, backfill, batch_size, fields)
+
+    is_known = None
+    if store is not None:
+        is_known = lambda match_id: bool(store.known_match_ids([match_id]))
+
+    processed_match_ids = set()
+    for start in range(0, len(batches), FIELDS_PER_REQUEST):
+        group = batches[start:start + FIELDS_PER_REQUEST]
+        document, aliases = build_document(batch_fields[start:start + FIELDS_PER_REQUEST])
+        stream = MatchStream(
+            {alias: batch for alias, (batch, _) in zip(aliases, group)},
+            tracking,
+            processed_match_ids,
+            is_known
+        )
+
+        unsaved = []
         try:
-            # Make the API request
-            response = requests.post(API_ENDPOINT, json=payload, headers=headers)
-            
-            # Raise an exception for bad responses
-            response.raise_for_status()
-            
-            # Parse the JSON response
-            data = response.json()
-            
-            # Process matches for this batch
-            batch_matches = process_matches(data, processed_match_ids)
-            
-            # Add new unique matches to the overall list
-            all_processed_matches.extend(batch_matches)
-            for match in batch_matches:
-                for player in match['players']:
-                    for item in player['items']:
-                        items.add(item)
-        
-        except requests.RequestException as e:
-            print(f"Error fetching matches for batch {current_batch}: {e}")
+            async with client.stream(document, priority) as response:
+                async for match in parse_matches_async(response, stream):
+                    yield match
 
+                    # Saved in small chunks so nothing accumulates here
+                    if store is not None:
+                        unsaved.append(match)
+                        if len(unsaved) >= STREAM_SAVE_CHUNK:
+                            store.save_matches(unsaved)
+                            unsaved = []
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error streaming matches for batches {[batch for batch, _ in group]}: {e}")
+            if store is not None:
+                store.save_matches(unsaved)
+            continue
 
+        if store is not None:
+            store.save_matches(unsaved)
 
-    return all_processed_matches
+            # A failed document keeps its old marks and is retried next poll
+            if stream.watermarks:
+                store.update_watermarks(stream.watermarks)
 
-def get_items():
-    # Prepare headers
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {API_KEY}',
-        'User-Agent': 'STRATZ_API'
-    }
-    
-    # Prepare payload
-    payload = {
-        'query': '''
-        {
-            constants{
-                items {
-                    id,
-                    name,
-                    image
-                }
-            }
+
+def run_with_client(function, *args, **kwargs):
+    # Blocking wrapper for command line use, the bot awaits the
+    # *_async functions directly with its own long lived client
+    async def run():
+        async with create_client() as client:
+            return await function(client, *args, **kwargs)
+
+    return asyncio.run(run())
+
+
+def fetch_dota_matches(incremental=False):
+    # Incremental runs probe first and only fetch the accounts that changed
+    if not incremental:
+        return run_with_client(fetch_dota_matches_async)
+    store = MatchStore()
+    try:
+        return run_with_client(fetch_changed_matches_async, store)
+    finally:
+        store.close()
+
+ITEMS_FIELD = '''constants {
+        items {
+          id,
+          name,
+          image
         }
-        '''
-    }
-    
+      }'''
+
+
+async def get_items_async(client, priority=BACKGROUND):
     try:
         # Make the API request
-        response = requests.post(API_ENDPOINT, json=payload, headers=headers)
-        
-        # Raise an exception for bad responses
-        response.raise_for_status()
-        
-        # Parse the JSON response
-        data = response.json()
+        data = await execute_one(client, ITEMS_FIELD, priority)
         
         # Return the list of items
-        return data.get('data', {}).get('items', [])
+        return (data.get('data', {}).get('constants') or {}).get('items') or []
     
-    except requests.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"Error fetching items: {e}")
         return []
+
+
+def get_items():
+    return run_with_client(get_items_async)
     
 
-def process_matches(response_data, processed_match_ids):
+@timed(PROCESS_MATCHES)
+def process_matches(response_data, processed_match_ids, store=None, tracking=None):
     # List to store processed matches for this batch
     processed_matches = []
+
+    if tracking is None:
+        tracking = get_tracking()
     
     # Navigate through the response structure
-    players = response_data.get('data', {}).get('players', [])
+    players = response_data.get('data', {}).get('players') or []
+
+    # Treat matches already in the local store as processed, one indexed
+    # lookup for the whole batch
+    if store is not None:
+        processed_match_ids.update(store.known_match_ids(
+            match.get('id')
+            for player in players
+            for match in player.get('matches', [])
+        ))
     
     # Iterate through each player's matches
     for player in players:
@@ -260,89 +511,79 @@ def process_matches(response_data, processed_match_ids):
                 for player_detail in match.get('players', [])
             )
             
-            # Check if at least two of our tracked accounts are in this match
-            matching_accounts = match_account_ids.intersection(STEAM_ACCOUNT_IDS)
-            if len(matching_accounts) < 2:
+            # Check if at least two tracked accounts of the same guild are in
+            # this match
+            matching_accounts = tracking.matching_accounts(match_account_ids)
+            if not matching_accounts:
                 continue
             
             # Mark this match as processed
             processed_match_ids.add(match_id)
             
-            match_info = {
-                'match_id': match_id,
-                'start_datetime': match.get('startDateTime'),
-                'radiant_win': match.get('didRadiantWin'),
-                'duration_seconds': match.get('durationSeconds'),
-                'average_rank': match.get('averageRank'),
-                'radiant_kills': match.get('radiantKills'),
-                'dire_kills': match.get('direKills'),
-                'lane_outcomes': {
-                    'mid': match.get('midLaneOutcome'),
-                    'bottom': match.get('bottomLaneOutcome'),
-                    'top': match.get('topLaneOutcome')
-                },
-                'matched_account_ids': list(matching_accounts),
-                'players': []
-            }
-            
-            # Process player details for this match
-            for player_detail in match.get('players', []):
-                player_info = {
-                    'steam_account_id': player_detail.get('steamAccount', {}).get('id'),
-                    'steam_account_name': player_detail.get('steamAccount', {}).get('name'),
-                    'is_radiant': player_detail.get('isRadiant'),
-                    'hero': {
-                        'id': player_detail.get('hero', {}).get('id'),
-                        'short_name': player_detail.get('hero', {}).get('shortName'),
-                        'name': player_detail.get('hero', {}).get('name')
-                    },
-                    'performance': {
-                        'kills': player_detail.get('kills'),
-                        'deaths': player_detail.get('deaths'),
-                        'assists': player_detail.get('assists'),
-                        'networth': player_detail.get('networth'),
-                        'lane': player_detail.get('lane'),
-                        'role': player_detail.get('role')
-                    },
-                    'items': [
-                        player_detail.get(f'item{i}Id') for i in range(6)
-                    ],
-                    'neutral_item': player_detail.get('neutral0Id')
-                }
-                
-                match_info['players'].append(player_info)
+            # Compact record with a dict-compatible view, see models.Match
+            match_info = Match.from_response(match, matching_accounts)
             
             processed_matches.append(match_info)
     
     return processed_matches
 
 
+def print_match(match):
+    # Convert timestamp to readable datetime
+    match_time = datetime.fromtimestamp(match['start_datetime'])
+    
+    print(f"Match ID: {match['match_id']}")
+    print(f"Match Time: {match_time}")
+    print(f"Radiant Win: {match['radiant_win']}")
+    print(f"Matched Account IDs: {match['matched_account_ids']}")
+    print("Players:")
+    for player in match['players']:
+        print(f"  - {player['steam_account_name']} ({player['hero']['short_name']})")
+        if (player['steam_account_name'] == 'Jerboa'):
+            print(player)
+    print("\n")
+
+
+async def print_streamed_matches(client, store=None):
+    count = 0
+    async for match in stream_dota_matches_async(client, store=store):
+        print_match(match)
+        count += 1
+    return count
+
+
 # Example usage
 def main():
+    # Load environment variables from a .env file
+    load_dotenv()
+
     print("Getting matches...")
-    matches = fetch_dota_matches()
+    # --incremental only fetches matches newer than the stored high-water
+    # marks, and only for accounts whose newest match changed
+    incremental = '--incremental' in sys.argv
+
+    # --stream prints matches as they are parsed instead of after the fetch
+    if '--stream' in sys.argv:
+        store = MatchStore() if incremental else None
+        try:
+            count = run_with_client(print_streamed_matches, store=store)
+        finally:
+            if store is not None:
+                store.close()
+        print(f"Total unique matches found: {count}")
+        return
+
+    matches = fetch_dota_matches(incremental=incremental)
     
     if matches:
         print(f"Total unique matches found: {len(matches)}")
         
         # Print or further process the matches
         for match in matches:
-            # Convert timestamp to readable datetime
-            match_time = datetime.fromtimestamp(match['start_datetime'])
-            
-            print(f"Match ID: {match['match_id']}")
-            print(f"Match Time: {match_time}")
-            print(f"Radiant Win: {match['radiant_win']}")
-            print(f"Matched Account IDs: {match['matched_account_ids']}")
-            print("Players:")
-            for player in match['players']:
-                print(f"  - {player['steam_account_name']} ({player['hero']['short_name']})")
-                if (player['steam_account_name'] == 'Jerboa'):
-                    print(player)
-            print("\n")
+            print_match(match)
             
             
         
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,283 @@
+import sys
+from array import array
+from collections.abc import Mapping
+
+# Compact in-memory match records. A match keeps its per-player stats in
+# columnar arrays instead of a tree of dicts, and exposes read-only Mapping
+# views with the same keys process_matches used to produce, so callers can
+# keep writing match['players'][0]['hero']['short_name'].
+
+PLAYERS_PER_MATCH = 10
+ITEM_SLOTS = 6
+
+# Stored in signed arrays in place of None
+MISSING = -1
+
+
+def to_code(value):
+    return MISSING if value is None else value
+
+
+def from_code(value):
+    return None if value == MISSING else value
+
+
+def intern(value):
+    # Lanes, roles, outcomes and hero names repeat constantly, share one copy
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class PlayerView(Mapping):
+    __slots__ = ('match', 'index')
+
+    KEYS = ('steam_account_id', 'steam_account_name', 'is_radiant', 'hero', 'performance', 'items', 'neutral_item')
+
+    def __init__(self, match, index):
+        self.match = match
+        self.index = index
+
+    def __getitem__(self, key):
+        match = self.match
+        i = self.index
+        if key == 'steam_account_id':
+            return from_code(match.account_ids[i])
+        if key == 'steam_account_name':
+            return match.account_names[i]
+        if key == 'is_radiant':
+            return match.radiant[i]
+        if key == 'hero':
+            return {
+                'id': from_code(match.hero_ids[i]),
+                'short_name': match.hero_short_names[i],
+                'name': match.hero_names[i]
+            }
+        if key == 'performance':
+            return {
+                'kills': from_code(match.kills[i]),
+                'deaths': from_code(match.deaths[i]),
+                'assists': from_code(match.assists[i]),
+                'networth': from_code(match.networth[i]),
+                'lane': match.lanes[i],
+                'role': match.roles[i]
+            }
+        if key == 'items':
+            start = i * ITEM_SLOTS
+            return [from_code(item) for item in match.items[start:start + ITEM_SLOTS]]
+        if key == 'neutral_item':
+            return from_code(match.neutral_items[i])
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def to_dict(self):
+        return {key: self[key] for key in self.KEYS}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class Match(Mapping):
+    __slots__ = (
+        'match_id', 'start_datetime', 'radiant_win', 'duration_seconds', 'average_rank',
+        'radiant_kills', 'dire_kills', 'mid_outcome', 'bottom_outcome', 'top_outcome',
+        'matched_account_ids',
+        # Per-player columns, one entry per player in match order
+        'account_ids', 'account_names', 'radiant', 'hero_ids', 'hero_short_names',
+        'hero_names', 'kills', 'deaths', 'assists', 'networth', 'lanes', 'roles',
+        'items', 'neutral_items',
+        # Heavy per-minute fields, None until loaded
+        'networth_leads', 'experience_leads'
+    )
+
+    KEYS = (
+        'match_id', 'start_datetime', 'radiant_win', 'duration_seconds', 'average_rank',
+        'radiant_kills', 'dire_kills', 'lane_outcomes', 'matched_account_ids', 'players',
+        'radiant_networth_leads', 'radiant_experience_leads'
+    )
+
+    @property
+    def player_count(self):
+        return len(self.account_ids)
+
+    def __getitem__(self, key):
+        if key == 'lane_outcomes':
+            return {'mid': self.mid_outcome, 'bottom': self.bottom_outcome, 'top': self.top_outcome}
+        if key == 'players':
+            return [PlayerView(self, i) for i in range(len(self.account_ids))]
+        if key == 'matched_account_ids':
+            return list(self.matched_account_ids)
+        if key == 'radiant_networth_leads':
+            return None if self.networth_leads is None else list(self.networth_leads)
+        if key == 'radiant_experience_leads':
+            return None if self.experience_leads is None else list(self.experience_leads)
+        if key in self.KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f'Match({self.match_id})'
+
+    @property
+    def has_details(self):
+        # None until the details were fetched, empty if STRATZ had none
+        return self.networth_leads is not None and self.experience_leads is not None
+
+    def set_details(self, networth_leads, experience_leads):
+        self.networth_leads = None if networth_leads is None else array('i', networth_leads)
+        self.experience_leads = None if experience_leads is None else array('i', experience_leads)
+
+    def to_dict(self):
+        # The nested dict process_matches used to build
+        match_info = {key: self[key] for key in self.KEYS}
+        match_info['players'] = [player.to_dict() for player in match_info['players']]
+        return match_info
+
+    @classmethod
+    def _create(cls, match_id, start_datetime, radiant_win, duration_seconds, average_rank,
+                radiant_kills, dire_kills, lane_outcomes, matched_account_ids, players,
+                networth_leads=None, experience_leads=None):
+        # players is a list of (account_id, account_name, is_radiant, hero_id,
+        # hero_short_name, hero_name, kills, deaths, assists, networth, lane,
+        # role, items, neutral_item) tuples
+        match = cls.__new__(cls)
+        match.match_id = match_id
+        match.start_datetime = start_datetime
+        match.radiant_win = radiant_win
+        match.duration_seconds = duration_seconds
+        match.average_rank = average_rank
+        match.radiant_kills = radiant_kills
+        match.dire_kills = dire_kills
+        match.mid_outcome = intern(lane_outcomes.get('mid'))
+        match.bottom_outcome = intern(lane_outcomes.get('bottom'))
+        match.top_outcome = intern(lane_outcomes.get('top'))
+        match.matched_account_ids = tuple(matched_account_ids)
+
+        match.account_ids = array('q', [to_code(player[0]) for player in players])
+        match.account_names = tuple(player[1] for player in players)
+        match.radiant = tuple(player[2] for player in players)
+        match.hero_ids = array('h', [to_code(player[3]) for player in players])
+        match.hero_short_names = tuple(intern(player[4]) for player in players)
+        match.hero_names = tuple(intern(player[5]) for player in players)
+        match.kills = array('h', [to_code(player[6]) for player in players])
+        match.deaths = array('h', [to_code(player[7]) for player in players])
+        match.assists = array('h', [to_code(player[8]) for player in players])
+        match.networth = array('i', [to_code(player[9]) for player in players])
+        match.lanes = tuple(intern(player[10]) for player in players)
+        match.roles = tuple(intern(player[11]) for player in players)
+        match.items = array('i', [
+            to_code(item)
+            for player in players
+            for item in (list(player[12]) + [None] * ITEM_SLOTS)[:ITEM_SLOTS]
+        ])
+        match.neutral_items = array('i', [to_code(player[13]) for player in players])
+        match.set_details(networth_leads, experience_leads)
+        return match
+
+    @classmethod
+    def from_response(cls, match, matched_account_ids):
+        # Build straight from a STRATZ match in the GraphQL response
+        players = []
+        for player_detail in match.get('players', []):
+            steam_account = player_detail.get('steamAccount') or {}
+            hero = player_detail.get('hero') or {}
+            players.append((
+                steam_account.get('id'),
+                steam_account.get('name'),
+                player_detail.get('isRadiant'),
+                hero.get('id'),
+                hero.get('shortName'),
+                hero.get('name'),
+                player_detail.get('kills'),
+                player_detail.get('deaths'),
+                player_detail.get('assists'),
+                player_detail.get('networth'),
+                player_detail.get('lane'),
+                player_detail.get('role'),
+                [player_detail.get(f'item{i}Id') for i in range(ITEM_SLOTS)],
+                player_detail.get('neutral0Id')
+            ))
+
+        return cls._create(
+            match.get('id'),
+            match.get('startDateTime'),
+            match.get('didRadiantWin'),
+            match.get('durationSeconds'),
+            match.get('averageRank'),
+            match.get('radiantKills'),
+            match.get('direKills'),
+            {
+                'mid': match.get('midLaneOutcome'),
+                'bottom': match.get('bottomLaneOutcome'),
+                'top': match.get('topLaneOutcome')
+            },
+            matched_account_ids,
+            players,
+            match.get('radiantNetworthLeads'),
+            match.get('radiantExperienceLeads')
+        )
+
+    @classmethod
+    def from_dict(cls, match_info):
+        # Build from the nested dict form, e.g. as stored by MatchStore
+        players = []
+        for player in match_info.get('players', []):
+            hero = player.get('hero') or {}
+            performance = player.get('performance') or {}
+            players.append((
+                player.get('steam_account_id'),
+                player.get('steam_account_name'),
+                player.get('is_radiant'),
+                hero.get('id'),
+                hero.get('short_name'),
+                hero.get('name'),
+                performance.get('kills'),
+                performance.get('deaths'),
+                performance.get('assists'),
+                performance.get('networth'),
+                performance.get('lane'),
+                performance.get('role'),
+                player.get('items') or [],
+                player.get('neutral_item')
+            ))
+
+        return cls._create(
+            match_info.get('match_id'),
+            match_info.get('start_datetime'),
+            match_info.get('radiant_win'),
+            match_info.get('duration_seconds'),
+            match_info.get('average_rank'),
+            match_info.get('radiant_kills'),
+            match_info.get('dire_kills'),
+            match_info.get('lane_outcomes') or {},
+            match_info.get('matched_account_ids') or [],
+            players,
+            match_info.get('radiant_networth_leads'),
+            match_info.get('radiant_experience_leads')
+        )
+
+
+def get_lane_key(lane, is_radiant):
+    # Which lane_outcomes entry a player's lane maps to, safe lane is bottom
+    # for radiant and top for dire
+    if lane == 'MID_LANE':
+        return 'mid'
+    if lane == 'SAFE_LANE':
+        return 'bottom' if is_radiant else 'top'
+    if lane == 'OFF_LANE':
+        return 'top' if is_radiant else 'bottom'
+    return None
+
+
+def as_dict(match):
+    # Plain nested dict for either representation
+    return match.to_dict() if isinstance(match, Match) else match
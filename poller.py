@@ -0,0 +1,153 @@
+import time
+import asyncio
+import aiohttp
+from matches import fetch_changed_matches_async, load_match_details_async
+
+# Seconds between polls right after new matches turned up, the longest wait
+# while the tracked players are still in a session, and when they're idle
+ACTIVE_INTERVAL = 30
+SESSION_INTERVAL = 120
+IDLE_INTERVAL = 900
+
+# Players count as in a session until this long after their last match ended
+SESSION_GAP = 90 * 60
+
+# Only matches started this recently are posted, so a first run or a long
+# outage doesn't flood the channel with old matches
+POST_WINDOW = 6 * 60 * 60
+
+# Matches rendered into one message: 5 pages of draw.MATCHES_PER_PAGE, so
+# a message stays within Discord's 10 attachments and its upload size limit.
+# Not computed from draw, which would load Pillow into the bot process.
+MATCHES_PER_MESSAGE = 20
+
+
+def next_interval(previous, found_new, last_match_end, now):
+    # Poll fast right after matches turn up and back off while nothing new
+    # arrives, to a limit that depends on whether a session is still going
+    if found_new:
+        return ACTIVE_INTERVAL
+    in_session = last_match_end is not None and now - last_match_end < SESSION_GAP
+    return min(previous * 2, SESSION_INTERVAL if in_session else IDLE_INTERVAL)
+
+
+class MatchPoller:
+    # Background task that fetches new matches into the store and posts the
+    # ones each channel hasn't seen. What was posted is kept in the store, so
+    # a restart picks up where it left off without reposting.
+    def __init__(self, client, store, renderer, send, channels, fetch=None, encoding=None, constants=None,
+                 constants_changed=None):
+        # channels() returns {channel id: account ids} for every channel to
+        # post to, each gets the matches of its own guild's accounts. One
+        # fetch per cycle covers them all, by default a probe of everyone's
+        # newest match and a full fetch only of the accounts that changed.
+        # send(channel_id, pages, encoding) posts rendered pages, fetch()
+        # replaces the default fetch, e.g. to share it. constants, a
+        # ConstantsCache, is kept fresh every cycle, the first one included,
+        # and constants_changed() is awaited after the first cycle's check
+        # and every refetch, to update what is built from them.
+        self.client = client
+        self.store = store
+        self.renderer = renderer
+        self.send = send
+        self.channels = channels
+        self.fetch = fetch or (lambda: fetch_changed_matches_async(client, store, constants=constants))
+        self.encoding = encoding
+        self.constants = constants
+        self.constants_changed = constants_changed
+        self._constants_seen = False
+
+        self.interval = ACTIVE_INTERVAL
+        self.polls = 0
+        self.posted = 0
+        self.last_poll = None
+
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def last_match_end(self):
+        latest = self.store.get_matches(limit=1)
+        if not latest:
+            return None
+        return (latest[0]['start_datetime'] or 0) + (latest[0]['duration_seconds'] or 0)
+
+    async def refresh_constants(self):
+        # Refetched once the TTL runs out or a patch is out, otherwise this is
+        # one small version check. Returns True if they were refetched.
+        if self.constants is None:
+            return False
+        try:
+            return await self.constants.ensure_fresh(self.client)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Polling goes on with the constants we have
+            print(f"Error refreshing constants: {e}")
+            return False
+
+    async def poll_once(self):
+        # One cycle, returns the number of matches posted
+        refreshed = await self.refresh_constants()
+        if self.constants_changed is not None and (refreshed or not self._constants_seen):
+            # The first time for the snapshot left from the last run
+            self._constants_seen = True
+            try:
+                await self.constants_changed()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error updating from the new constants: {e}")
+        channels = self.channels()
+        if not channels:
+            return 0
+        await self.fetch()
+
+        posted = 0
+        since = int(time.time()) - POST_WINDOW
+        for channel_id, account_ids in channels.items():
+            try:
+                posted += await self.post_channel(channel_id, account_ids, since)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # One channel failing, e.g. a deleted one, doesn't hold up the rest
+                print(f"Error posting matches to channel {channel_id}: {e}")
+        return posted
+
+    async def post_channel(self, channel_id, account_ids, since):
+        pending = self.store.unposted_matches(channel_id, since, account_ids)
+        posted = 0
+        for start in range(0, len(pending), MATCHES_PER_MESSAGE):
+            batch = pending[start:start + MATCHES_PER_MESSAGE]
+            await load_match_details_async(self.client, batch, self.store)
+            pages = await self.renderer.render_batch(batch, self.encoding)
+            await self.send(channel_id, pages, self.encoding)
+
+            # Only marked once Discord has them, a failed post is retried
+            self.store.mark_posted(channel_id, [match.match_id for match in batch], int(time.time()))
+            posted += len(batch)
+        return posted
+
+    async def run(self):
+        while True:
+            posted = 0
+            try:
+                posted = await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep polling whatever went wrong, the next cycle retries
+                print(f"Error polling matches: {e}")
+
+            self.polls += 1
+            self.posted += posted
+            self.last_poll = time.time()
+            self.interval = next_interval(self.interval, posted > 0, self.last_match_end(), time.time())
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,109 @@
+from scheduler import BACKGROUND
+
+# Number of Steam accounts asked for in a single players(...) field
+PLAYERS_PER_BATCH = 5
+
+# Number of aliased root fields packed into a single GraphQL document
+FIELDS_PER_REQUEST = 8
+
+
+def players_field(account_ids, matches_request, selection, player_fields=()):
+    # players(...) root field asking for the matches of several accounts,
+    # player_fields are asked for on each player next to its matches
+    ids_string = ','.join(map(str, account_ids))
+    request_string = ', '.join(f'{key}: {graphql_value(value)}' for key, value in matches_request.items())
+    player_lines = ''.join(f'        {field}\n' for field in player_fields)
+    return '''players(steamAccountIds:[%s]) {
+%s        matches(request:{%s}) {
+%s
+        }
+      }''' % (ids_string, player_lines, request_string, selection)
+
+
+def match_field(match_id, selection):
+    # match(id:...) root field for a single match
+    return '''match(id: %d) {
+%s
+      }''' % (match_id, selection)
+
+
+def build_selection(fields, indent='          '):
+    # Selection set from a field declaration: names, or (name, subfields)
+    # pairs for nested objects, e.g. ('id', ('hero', ('id', 'shortName')))
+    lines = []
+    for field in fields:
+        if isinstance(field, str):
+            lines.append(indent + field)
+        else:
+            name, subfields = field
+            lines.append(
+                indent + name + ' {\n' +
+                build_selection(subfields, indent + '  ') + '\n' +
+                indent + '}'
+            )
+    return ',\n'.join(lines)
+
+
+def graphql_value(value):
+    # Python value to GraphQL literal for the simple argument types we use
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def batch_accounts(account_ids, batch_size=PLAYERS_PER_BATCH):
+    return [account_ids[i:i+batch_size] for i in range(0, len(account_ids), batch_size)]
+
+
+def build_document(fields):
+    # Pack several root fields into one document, each under its own alias
+    aliases = [f'q{i}' for i in range(len(fields))]
+    body = '\n      '.join(f'{alias}: {field}' for alias, field in zip(aliases, fields))
+    return '{\n      %s\n    }' % body, aliases
+
+
+def root_name(field):
+    # Name of the root field, e.g. 'players' for 'players(steamAccountIds:...)'
+    return field.split('(', 1)[0].split('{', 1)[0].strip()
+
+
+def split_response(response_data, fields, aliases):
+    # Turn one aliased response back into the response each field would have
+    # got if it had been sent on its own
+    data = response_data.get('data') or {}
+    errors = response_data.get('errors') or []
+
+    results = []
+    for field, alias in zip(fields, aliases):
+        result = {'data': {root_name(field): data.get(alias)}}
+        field_errors = [error for error in errors if (error.get('path') or [None])[0] == alias]
+        if field_errors:
+            result['errors'] = field_errors
+        results.append(result)
+    return results
+
+
+async def execute(client, fields, fields_per_request=FIELDS_PER_REQUEST, priority=BACKGROUND):
+    # Send the given root fields in as few requests as possible and return
+    # one response per field, in order. A failed request puts its exception
+    # in place of the response for every field it carried.
+    groups = [fields[i:i+fields_per_request] for i in range(0, len(fields), fields_per_request)]
+    documents = [build_document(group) for group in groups]
+
+    responses = await client.query_many([query for query, _ in documents], priority)
+
+    results = []
+    for group, (_, aliases), response in zip(groups, documents, responses):
+        if isinstance(response, Exception):
+            results.extend([response] * len(group))
+        else:
+            results.extend(split_response(response, group, aliases))
+    return results
+
+
+async def execute_one(client, field, priority=BACKGROUND):
+    # Single field convenience wrapper, raises instead of returning errors
+    result = (await execute(client, [field], priority=priority))[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import tracing
+from encoding import encode
+from glyphs import COUNTERS
+
+# Default number of worker processes rendering tables
+DEFAULT_WORKERS = 2
+
+# Renders allowed to wait for a worker before new requests are turned away
+DEFAULT_MAX_QUEUE = 16
+
+# Font sizes used by the table cells, loaded once per worker
+PRELOAD_FONT_SIZES = (12, 24)
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+def init_worker(matches=()):
+    # Runs once in every worker process so the first render in it doesn't pay
+    # for loading fonts, the item atlas, the image cache or hero portraits.
+    # The matches are drawn and encoded once and thrown away, see draw.prewarm.
+    import draw
+    for size in PRELOAD_FONT_SIZES:
+        draw.get_font(size)
+        draw.get_font_metrics(size)
+    draw.get_item_atlas()
+    draw.get_image_cache()
+
+    try:
+        for image in draw.prewarm(matches):
+            encode(image)
+    except Exception as e:
+        # The worker still renders, its first table is just slower
+        print(f"Error warming up render worker: {e}")
+
+    # Warming up isn't counted in the timings or text cache hit rates
+    tracing.drain()
+    draw.get_text_cache().drain()
+
+
+def worker_ready():
+    return os.getpid()
+
+
+def render_match(match, encoding=None):
+    # Worker side: build and draw the table, hand back the encoded bytes
+    # along with the stage timings and text cache counts from this process
+    import draw
+    draw.reload_item_atlas()
+    image = draw.build_match_table(match).draw()
+    return encode(image, encoding), tracing.drain(), draw.get_text_cache().drain()
+
+
+def render_matches(matches, encoding=None):
+    # Worker side for a batch: the matches drawn onto a few pages, each
+    # encoded once
+    import draw
+    draw.reload_item_atlas()
+    pages = [encode(image, encoding) for image in draw.draw_match_pages(matches)]
+    return pages, tracing.drain(), draw.get_text_cache().drain()
+
+
+def update_item_atlas():
+    # Worker side: rebuild the item atlas from the constants snapshot the bot
+    # saved, if the game version changed since it was built. The other
+    # workers load the new one before their next render. Hands back the
+    # atlas' game version.
+    import draw
+    from constants import ConstantsCache
+    constants = ConstantsCache()
+    atlas = None if constants.is_empty else draw.refresh_item_atlas(constants)
+    return atlas and atlas.game_version, tracing.drain(), draw.get_text_cache().drain()
+
+
+def prefetch_hero_images():
+    # Worker side: download every hero portrait in the constants snapshot
+    # that isn't cached yet, so warming up and drawing find them on disk.
+    # Hands back the number that couldn't be fetched.
+    import draw
+    from constants import ConstantsCache
+    failed = draw.get_image_cache().prefetch_heroes(ConstantsCache())
+    return failed, tracing.drain(), draw.get_text_cache().drain()
+
+
+class RenderService:
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.render_seconds = 0.0
+        self.text_cache = dict.fromkeys(COUNTERS, 0)
+
+        self._executor = None
+        self._slots = asyncio.Semaphore(workers)
+
+    def start(self, warm_matches=()):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_worker, initargs=(list(warm_matches),)
+            )
+        return self
+
+    def wait_ready(self, poll=0.05):
+        # Block until every worker has started and warmed up in init_worker.
+        # A worker only takes work once its initializer is done, so it is
+        # ready once it has answered, but a warm worker can answer for a
+        # slower one too, hence asking until every process has.
+        self.start()
+        ready = set()
+        while True:
+            futures = [self._executor.submit(worker_ready) for _ in range(self.workers)]
+            ready.update(future.result() for future in futures)
+            if len(ready) >= self.workers:
+                return
+            time.sleep(poll)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def metrics(self):
+        text_cache = self.text_cache
+        metrics_total = text_cache['metrics_hits'] + text_cache['metrics_misses']
+        sprite_total = text_cache['sprite_hits'] + text_cache['sprite_misses']
+        return {
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'average_render_seconds': self.render_seconds / self.completed if self.completed else 0.0,
+            'text_metrics_hit_rate': text_cache['metrics_hits'] / metrics_total if metrics_total else 0.0,
+            'text_sprite_hit_rate': text_cache['sprite_hits'] / sprite_total if sprite_total else 0.0
+        }
+
+    async def render(self, match, encoding=None):
+        # Render a match table in a worker process and return the encoded
+        # bytes, see encoding.ENCODINGS. Raises RenderQueueFull instead of
+        # queueing without bound.
+        return await self._run(render_match, match, encoding)
+
+    async def render_batch(self, matches, encoding=None):
+        # Render several matches onto a few pages in one worker call and
+        # return the encoded bytes of each page
+        return await self._run(render_matches, list(matches), encoding)
+
+    async def update_item_atlas(self):
+        # Rebuilt in a worker so Pillow stays out of the calling process,
+        # returns the game version of the atlas now on disk
+        return await self._run(update_item_atlas)
+
+    async def prefetch_hero_images(self):
+        # Downloaded in a worker, returns the number that failed
+        return await self._run(prefetch_hero_images)
+
+    async def _run(self, function, *args):
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise RenderQueueFull(f'{self.queue_depth} renders already waiting')
+
+        self.start()
+        self.queue_depth += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queue_depth -= 1
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        executor = self._executor
+        try:
+            loop = asyncio.get_running_loop()
+            result, timings, text_counts = await loop.run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            # A worker died (killed, out of memory) and the pool refuses all
+            # work from then on. Drop it so the next render starts a new one,
+            # unless another render already has.
+            self.failed += 1
+            if self._executor is executor:
+                self.close()
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+        self.completed += 1
+        self.render_seconds += time.perf_counter() - started
+        tracing.merge(timings)
+        for name, count in text_counts.items():
+            self.text_cache[name] += count
+        return result
@@ -0,0 +1,126 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Request priorities, lower values are sent first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# STRATZ default token limits
+DEFAULT_PER_SECOND = 20
+DEFAULT_PER_MINUTE = 250
+
+# Status codes that are worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        # rate is tokens added per second, capacity is the burst size
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        # Seconds until a token is available, 0 if one is available now
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RequestScheduler:
+    def __init__(self, per_second=DEFAULT_PER_SECOND, per_minute=DEFAULT_PER_MINUTE,
+                 max_retries=5, base_delay=0.5, max_delay=30):
+        self.buckets = [
+            TokenBucket(per_second, per_second),
+            TokenBucket(per_minute / 60, per_minute)
+        ]
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        # Requests waiting for a token, ordered by (priority, arrival)
+        self._waiting = []
+        self._counter = itertools.count()
+        self._dispatcher = None
+
+        # Set when the server tells us to back off, nothing is sent before it
+        self._paused_until = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._waiting)
+
+    async def acquire(self, priority=BACKGROUND):
+        # Wait until the rate limits allow another request. Higher priority
+        # requests are granted tokens before lower priority ones.
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._counter), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiting:
+            # Drop requests that were cancelled while queued
+            if self._waiting[0][2].done():
+                heapq.heappop(self._waiting)
+                continue
+
+            delay = max(
+                [self._paused_until - time.monotonic()] +
+                [bucket.delay() for bucket in self.buckets]
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._waiting)
+            if future.done():
+                continue
+            for bucket in self.buckets:
+                bucket.consume()
+            future.set_result(None)
+
+    def backoff(self, attempt, retry_after=None):
+        # Full jitter exponential backoff, never shorter than Retry-After
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            # A rate limit applies to every request, so hold the whole queue
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        return delay
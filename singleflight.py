@@ -0,0 +1,67 @@
+import asyncio
+from collections import OrderedDict
+
+# Rendered images kept by RenderCache
+DEFAULT_MAX_ENTRIES = 256
+
+
+class SingleFlight:
+    # Concurrent calls for the same key share one run of the work: the first
+    # caller starts it and everyone else awaits the same task
+    def __init__(self):
+        self.started = 0
+        self.joined = 0
+        self._in_flight = {}
+
+    async def run(self, key, produce):
+        task = self._in_flight.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(produce())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.joined += 1
+
+        # A caller giving up (e.g. a timed out interaction) must not cancel
+        # the work for the others waiting on it
+        return await asyncio.shield(task)
+
+
+class RenderCache(SingleFlight):
+    # Results by key in a bounded LRU, with single-flight for misses. Failed
+    # work isn't cached, the next call tries again.
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    async def get(self, key, produce):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        result = await self.run(key, produce)
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    @property
+    def metrics(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'started': self.started,
+            'joined': self.joined,
+            'in_flight': len(self._in_flight)
+        }
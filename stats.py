@@ -0,0 +1,299 @@
+import time
+import argparse
+from models import get_lane_key
+
+# Rolling counters over the tracked players' matches. Each match is added
+# once, when it is first stored, into one bucket per day it started in, so a
+# summary over a period sums a row per day instead of rescanning matches.
+#
+# The counters are shared by every guild: a player is counted in every match
+# that was a party match for any guild tracking them. A guild's /stats picks
+# its own players and stacks out of them, but a player two guilds track has
+# the same numbers in both, including matches that only counted for the
+# other guild and that its /recent doesn't show. Stacks are exact, a stack
+# is only made of the guild's own players.
+
+BUCKET_SECONDS = 24 * 60 * 60
+
+# What the counters are kept for. A hero is counted for the tracked players
+# who played it, a stack is the tracked players on one team of a match.
+ACCOUNT = 'account'
+HERO = 'hero'
+ACCOUNT_HERO = 'account_hero'
+STACK = 'stack'
+
+# Counter columns, in the order the store keeps them. A stack counts one
+# game per match and its members' kills, deaths, networth and lanes summed.
+COUNTERS = (
+    'games', 'wins', 'kills', 'deaths', 'assists', 'networth',
+    'lane_wins', 'lane_ties', 'lane_losses'
+)
+
+# Period /stats covers by default
+DEFAULT_DAYS = 30
+
+# Smallest team of tracked players counted as a stack
+MIN_STACK_SIZE = 2
+
+# Rows per table in a report, keeps /stats under Discord's message limit
+MAX_ROWS = 8
+MAX_LABEL_WIDTH = 32
+
+
+def bucket_of(timestamp):
+    return (timestamp or 0) // BUCKET_SECONDS
+
+
+def account_hero_subject(account_id, hero):
+    return f'{account_id}:{hero}'
+
+
+def stack_subject(account_ids):
+    return ','.join(str(account_id) for account_id in sorted(account_ids))
+
+
+def lane_result(outcome, is_radiant):
+    # 1 if the player's side won the lane, 0 for a tie, -1 if it lost and
+    # None when the outcome isn't known
+    if outcome == 'TIE':
+        return 0
+    if outcome in ('RADIANT_VICTORY', 'RADIANT_STOMP'):
+        return 1 if is_radiant else -1
+    if outcome in ('DIRE_VICTORY', 'DIRE_STOMP'):
+        return -1 if is_radiant else 1
+    return None
+
+
+def player_counters(match, player):
+    performance = player['performance']
+    won = match['radiant_win'] is not None and match['radiant_win'] == player['is_radiant']
+    lane_key = get_lane_key(performance['lane'], player['is_radiant'])
+    lane = lane_result(match['lane_outcomes'].get(lane_key), player['is_radiant'])
+    return (
+        1,
+        int(won),
+        performance['kills'] or 0,
+        performance['deaths'] or 0,
+        performance['assists'] or 0,
+        performance['networth'] or 0,
+        int(lane == 1),
+        int(lane == 0),
+        int(lane == -1)
+    )
+
+
+def add_counters(total, counters):
+    if total is None:
+        return tuple(counters)
+    return tuple(a + b for a, b in zip(total, counters))
+
+
+def counter_changes(old, new):
+    # What turns one match_counters result into another, with negative
+    # counters for what has to be taken out
+    zero = (0,) * len(COUNTERS)
+    changes = {}
+    for key in set(old) | set(new):
+        change = tuple(b - a for a, b in zip(old.get(key, zero), new.get(key, zero)))
+        if any(change):
+            changes[key] = change
+    return changes
+
+
+def match_counters(match):
+    # {(scope, subject, bucket): counters} one match adds
+    bucket = bucket_of(match['start_datetime'])
+    tracked = set(match['matched_account_ids'])
+    deltas = {}
+    teams = {}
+    for player in match['players']:
+        account_id = player['steam_account_id']
+        if account_id not in tracked:
+            continue
+        counters = player_counters(match, player)
+        hero = player['hero']['short_name']
+        keys = [(ACCOUNT, str(account_id), bucket)]
+        if hero:
+            keys.append((HERO, hero, bucket))
+            keys.append((ACCOUNT_HERO, account_hero_subject(account_id, hero), bucket))
+        for key in keys:
+            deltas[key] = add_counters(deltas.get(key), counters)
+
+        team = teams.setdefault(player['is_radiant'], [[], None])
+        team[0].append(account_id)
+        team[1] = add_counters(team[1], counters)
+
+    for account_ids, counters in teams.values():
+        if len(account_ids) >= MIN_STACK_SIZE:
+            # Once per match, not once per member
+            deltas[(STACK, stack_subject(account_ids), bucket)] = (1, counters[1] // len(account_ids)) + counters[2:]
+    return deltas
+
+
+def summarize(counters, players=1):
+    # Averages and rates from summed counters. Per game figures of a stack
+    # are per member, with players the size of the stack.
+    totals = dict(zip(COUNTERS, counters))
+    games = totals['games']
+    if not games:
+        return None
+    summary = dict(totals)
+    summary['winrate'] = totals['wins'] / games
+    summary['kills_per_game'] = totals['kills'] / games / players
+    summary['deaths_per_game'] = totals['deaths'] / games / players
+    summary['assists_per_game'] = totals['assists'] / games / players
+    summary['kda'] = (totals['kills'] + totals['assists']) / max(totals['deaths'], 1)
+    summary['networth_per_game'] = totals['networth'] / games / players
+    return summary
+
+
+def subject_accounts(scope, subject):
+    if scope == ACCOUNT:
+        return {int(subject)}
+    if scope == ACCOUNT_HERO:
+        return {int(subject.split(':', 1)[0])}
+    if scope == STACK:
+        return {int(account_id) for account_id in subject.split(',')}
+    return set()
+
+
+def get_stats(store, scope, subject=None, days=DEFAULT_DAYS, now=None, account_ids=None):
+    # {subject: summary} over the last days, most played first. account_ids
+    # limits it to one guild's players and stacks, and a hero to how just
+    # those players did on it. A player's own counts aren't filtered by
+    # guild, see the top of this module.
+    since = bucket_of((now or time.time()) - days * BUCKET_SECONDS) if days else None
+    if scope == HERO and account_ids is not None:
+        rows = {}
+        for account_hero, counters in store.get_aggregates(ACCOUNT_HERO, None, since).items():
+            account_id, hero = account_hero.split(':', 1)
+            if int(account_id) in account_ids and subject in (None, hero):
+                rows[hero] = add_counters(rows.get(hero), counters)
+    else:
+        rows = store.get_aggregates(scope, subject, since)
+        if account_ids is not None:
+            rows = {
+                subject: counters for subject, counters in rows.items()
+                if subject_accounts(scope, subject) <= account_ids
+            }
+    summaries = [
+        (subject, summarize(counters, len(subject.split(',')) if scope == STACK else 1))
+        for subject, counters in rows.items()
+    ]
+    summaries.sort(key=lambda item: item[1]['games'], reverse=True)
+    return dict(summaries)
+
+
+def account_names(store, account_ids):
+    # Latest Steam name of each account, from its newest stored match
+    names = {}
+    for account_id in account_ids:
+        latest = store.get_matches(account_id=account_id, limit=1)
+        for player in latest[0]['players'] if latest else []:
+            if player['steam_account_id'] == account_id:
+                names[account_id] = player['steam_account_name']
+    return names
+
+
+def format_stats(title, rows):
+    # Fixed width table of (label, summary) pairs under a title
+    width = min(max(len(label) for label, _ in rows), MAX_LABEL_WIDTH)
+    lines = [
+        title,
+        f"{'':<{width}} {'Games':>5} {'Win%':>5} {'K/D/A':>14} {'KDA':>5} {'Networth':>8} {'Lanes W-T-L':>12}"
+    ]
+    for label, summary in rows:
+        kda = f"{summary['kills_per_game']:.1f}/{summary['deaths_per_game']:.1f}/{summary['assists_per_game']:.1f}"
+        lanes = f"{summary['lane_wins']}-{summary['lane_ties']}-{summary['lane_losses']}"
+        lines.append(
+            f"{label[:width]:<{width}} {summary['games']:>5} {summary['winrate'] * 100:>4.0f}% {kda:>14} "
+            f"{summary['kda']:>5.2f} {summary['networth_per_game'] / 1000:>7.1f}k {lanes:>12}"
+        )
+    return '\n'.join(lines)
+
+
+def normalize_hero(hero):
+    # Hero short names as stored, e.g. 'Shadow Demon' finds shadow_demon
+    return hero.strip().lower().replace(' ', '_') if hero else None
+
+
+def stats_report(store, days=DEFAULT_DAYS, hero=None, account_id=None, now=None, account_ids=None):
+    # Text tables for /stats: the players and their stacks, one player's
+    # heroes, how everyone did on one hero, or one player on one hero.
+    # account_ids keeps it to one guild's tracked accounts, whose counts
+    # are shared with any other guild tracking them.
+    hero = normalize_hero(hero)
+    if account_ids is not None:
+        account_ids = set(account_ids)
+    names = account_names(store, [account_id] if account_id is not None else [])
+    player = names.get(account_id) or str(account_id)
+    period = f'last {days} days' if days else 'all time'
+
+    sections = []
+    if account_id is not None and hero:
+        rows = get_stats(store, ACCOUNT_HERO, account_hero_subject(account_id, hero), days, now, account_ids)
+        sections.append((f'{player} on {hero}, {period}', [(hero, summary) for summary in rows.values()]))
+    elif account_id is not None:
+        rows = get_stats(store, ACCOUNT, str(account_id), days, now, account_ids)
+        sections.append((f'{player}, {period}', [(player, summary) for summary in rows.values()]))
+        heroes = get_stats(store, ACCOUNT_HERO, days=days, now=now, account_ids=account_ids)
+        prefix = f'{account_id}:'
+        sections.append(('Heroes', [
+            (subject[len(prefix):], summary) for subject, summary in heroes.items() if subject.startswith(prefix)
+        ]))
+    elif hero:
+        rows = get_stats(store, HERO, hero, days, now, account_ids)
+        sections.append((f'{hero}, {period}', [('Everyone', summary) for summary in rows.values()]))
+        players = get_stats(store, ACCOUNT_HERO, days=days, now=now, account_ids=account_ids)
+        suffix = f':{hero}'
+        sections.append(('Players', [
+            (subject[:-len(suffix)], summary) for subject, summary in players.items() if subject.endswith(suffix)
+        ]))
+    else:
+        players = get_stats(store, ACCOUNT, days=days, now=now, account_ids=account_ids)
+        stacks = get_stats(store, STACK, days=days, now=now, account_ids=account_ids)
+        sections.append((f'Players, {period}', list(players.items())))
+        sections.append(('Stacks, per member', list(stacks.items())))
+
+    sections = [(title, rows[:MAX_ROWS]) for title, rows in sections if rows]
+    if not sections:
+        return None
+
+    # Account ids as names, for players and each member of a stack
+    account_ids = {
+        int(part) for _, rows in sections for subject, _ in rows
+        for part in subject.split(',') if part.isdigit()
+    }
+    names.update(account_names(store, account_ids - set(names)))
+
+    def label(subject):
+        return ', '.join(names.get(int(part)) or part if part.isdigit() else part for part in subject.split(','))
+
+    return '\n\n'.join(
+        format_stats(title, [(label(subject), summary) for subject, summary in rows])
+        for title, rows in sections
+    )
+
+
+def main():
+    from store import MatchStore
+
+    parser = argparse.ArgumentParser(description='Show or rebuild the aggregate match stats')
+    parser.add_argument('--rebuild', action='store_true', help='recount the aggregates from every stored match')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='period to summarize, 0 for all time')
+    parser.add_argument('--hero', help='hero short name, e.g. lina')
+    parser.add_argument('--account', type=int, help='Steam account id')
+    args = parser.parse_args()
+
+    store = MatchStore()
+    if args.rebuild:
+        started = time.perf_counter()
+        count = store.rebuild_aggregates()
+        print(f"Recounted {count} matches in {time.perf_counter() - started:.2f}s")
+
+    print(stats_report(store, args.days, args.hero, args.account) or 'No matches in that period')
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+import os
+import json
+import sqlite3
+from models import Match, as_dict
+from stats import COUNTERS, add_counters, counter_changes, match_counters
+from tracking import MIN_TRACKED_PLAYERS
+
+# Default location of the local database, can be overridden with MATCH_DB_PATH
+DEFAULT_DB_PATH = 'matches.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS account_watermarks (
+    steam_account_id INTEGER PRIMARY KEY,
+    last_start_datetime INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS matches (
+    match_id INTEGER PRIMARY KEY,
+    start_datetime INTEGER,
+    match_info TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS matches_start_datetime ON matches (start_datetime);
+
+CREATE TABLE IF NOT EXISTS match_accounts (
+    steam_account_id INTEGER NOT NULL,
+    start_datetime INTEGER,
+    match_id INTEGER NOT NULL REFERENCES matches (match_id),
+    PRIMARY KEY (steam_account_id, start_datetime, match_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS posted_matches (
+    channel_id INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    posted_at INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, match_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS guild_accounts (
+    guild_id INTEGER NOT NULL,
+    steam_account_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, steam_account_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS guild_channels (
+    guild_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS aggregated_matches (
+    match_id INTEGER PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS aggregates (
+    scope TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    kills INTEGER NOT NULL,
+    deaths INTEGER NOT NULL,
+    assists INTEGER NOT NULL,
+    networth INTEGER NOT NULL,
+    lane_wins INTEGER NOT NULL,
+    lane_ties INTEGER NOT NULL,
+    lane_losses INTEGER NOT NULL,
+    PRIMARY KEY (scope, subject, bucket)
+) WITHOUT ROWID;
+'''
+
+# Matches read at a time when the aggregates are rebuilt
+REBUILD_CHUNK_SIZE = 500
+
+
+class MatchStore:
+    def __init__(self, path=None):
+        self.path = path or os.getenv('MATCH_DB_PATH') or DEFAULT_DB_PATH
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def get_watermarks(self, account_ids):
+        # Newest match start time seen per account, accounts we have never
+        # polled are left out of the result
+        account_ids = list(account_ids)
+        if not account_ids:
+            return {}
+        placeholders = ','.join('?' * len(account_ids))
+        rows = self.connection.execute(
+            f'SELECT steam_account_id, last_start_datetime FROM account_watermarks '
+            f'WHERE steam_account_id IN ({placeholders})',
+            account_ids
+        )
+        return dict(rows.fetchall())
+
+    def update_watermarks(self, watermarks):
+        # Only ever move a watermark forward
+        with self.connection:
+            self.connection.executemany(
+                '''
+                INSERT INTO account_watermarks (steam_account_id, last_start_datetime)
+                VALUES (?, ?)
+                ON CONFLICT(steam_account_id) DO UPDATE SET
+                    last_start_datetime = MAX(last_start_datetime, excluded.last_start_datetime)
+                ''',
+                list(watermarks.items())
+            )
+
+    def known_match_ids(self, match_ids):
+        # Primary key lookup of which of the given matches are already stored
+        match_ids = [match_id for match_id in set(match_ids) if match_id is not None]
+        known = set()
+        # Stay well below SQLite's bound parameter limit
+        for i in range(0, len(match_ids), 500):
+            chunk = match_ids[i:i+500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f'SELECT match_id FROM matches WHERE match_id IN ({placeholders})',
+                chunk
+            )
+            known.update(row[0] for row in rows)
+        return known
+
+    def save_matches(self, matches, replace=False):
+        # Store processed matches, indexed by start time and by each tracked
+        # account that played in them. replace overwrites stored matches,
+        # e.g. once their details have been loaded.
+        conflict = 'REPLACE' if replace else 'IGNORE'
+        with self.connection:
+            self.connection.executemany(
+                f'INSERT OR {conflict} INTO matches (match_id, start_datetime, match_info) VALUES (?, ?, ?)',
+                [
+                    (match['match_id'], match['start_datetime'], json.dumps(as_dict(match)))
+                    for match in matches
+                ]
+            )
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO match_accounts (steam_account_id, start_datetime, match_id) VALUES (?, ?, ?)',
+                [
+                    (account_id, match['start_datetime'], match['match_id'])
+                    for match in matches
+                    for account_id in match['matched_account_ids']
+                ]
+            )
+            self._aggregate(matches)
+
+    def _aggregate(self, matches):
+        # Add each match into the aggregates the first time it is stored,
+        # in the same transaction, so saving it again doesn't count it twice
+        deltas = {}
+        for match in matches:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO aggregated_matches (match_id) VALUES (?)',
+                (match['match_id'],)
+            )
+            if cursor.rowcount:
+                for key, counters in match_counters(match).items():
+                    deltas[key] = add_counters(deltas.get(key), counters)
+        self._add_aggregates(deltas)
+
+    def _add_aggregates(self, deltas):
+        # Add {(scope, subject, bucket): counters} onto the stored counters,
+        # negative counters take a match back out
+        columns = ', '.join(COUNTERS)
+        placeholders = ', '.join('?' * len(COUNTERS))
+        updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in COUNTERS)
+        self.connection.executemany(
+            f'''
+            INSERT INTO aggregates (scope, subject, bucket, {columns})
+            VALUES (?, ?, ?, {placeholders})
+            ON CONFLICT(scope, subject, bucket) DO UPDATE SET {updates}
+            ''',
+            [key + counters for key, counters in deltas.items()]
+        )
+
+    def get_aggregates(self, scope, subject=None, since_bucket=None):
+        # {subject: summed counters} for a scope, optionally for one subject
+        # and from a bucket on. Reads a row per subject and bucket.
+        sums = ', '.join(f'SUM({column})' for column in COUNTERS)
+        query = f'SELECT subject, {sums} FROM aggregates WHERE scope = ?'
+        params = [scope]
+        if subject is not None:
+            query += ' AND subject = ?'
+            params.append(subject)
+        if since_bucket is not None:
+            query += ' AND bucket >= ?'
+            params.append(since_bucket)
+        query += ' GROUP BY subject'
+        return {row[0]: row[1:] for row in self.connection.execute(query, params)}
+
+    def rebuild_aggregates(self, chunk_size=REBUILD_CHUNK_SIZE):
+        # Recount the aggregates from every stored match, e.g. for a database
+        # from before they existed, returns the number of matches counted
+        with self.connection:
+            self.connection.execute('DELETE FROM aggregates')
+            self.connection.execute('DELETE FROM aggregated_matches')
+            count = 0
+            last_match_id = -1
+            while True:
+                rows = self.connection.execute(
+                    'SELECT match_id, match_info FROM matches WHERE match_id > ? ORDER BY match_id LIMIT ?',
+                    (last_match_id, chunk_size)
+                ).fetchall()
+                if not rows:
+                    return count
+                self._aggregate([Match.from_dict(json.loads(match_info)) for _, match_info in rows])
+                count += len(rows)
+                last_match_id = rows[-1][0]
+
+    def get_match(self, match_id):
+        row = self.connection.execute(
+            'SELECT match_info FROM matches WHERE match_id = ?',
+            (match_id,)
+        ).fetchone()
+        return Match.from_dict(json.loads(row[0])) if row else None
+
+    def get_matches(self, account_id=None, since=None, until=None, limit=None, account_ids=None):
+        # Stored matches, newest first, optionally for a single account and
+        # a start time range. account_ids limits them to one guild's party
+        # matches, ones with at least two of those accounts.
+        if account_id is not None:
+            query = (
+                'SELECT m.match_info FROM match_accounts a '
+                'JOIN matches m ON m.match_id = a.match_id '
+                'WHERE a.steam_account_id = ?'
+            )
+            params = [account_id]
+            column = 'a.start_datetime'
+        else:
+            query = 'SELECT match_info FROM matches m WHERE 1 = 1'
+            params = []
+            column = 'm.start_datetime'
+
+        if account_ids is not None:
+            condition, group_params = group_condition(account_ids)
+            query += f' AND {condition}'
+            params.extend(group_params)
+        if since is not None:
+            query += f' AND {column} >= ?'
+            params.append(since)
+        if until is not None:
+            query += f' AND {column} < ?'
+            params.append(until)
+
+        query += f' ORDER BY {column} DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        return [Match.from_dict(json.loads(row[0])) for row in self.connection.execute(query, params)]
+
+    def unposted_matches(self, channel_id, since, account_ids=None):
+        # Stored matches started since then that haven't been posted to the
+        # channel yet, oldest first, optionally only one guild's matches
+        query = (
+            'SELECT match_info FROM matches m '
+            'WHERE m.start_datetime >= ? AND NOT EXISTS ('
+            '    SELECT 1 FROM posted_matches p WHERE p.channel_id = ? AND p.match_id = m.match_id'
+            ')'
+        )
+        params = [since, channel_id]
+        if account_ids is not None:
+            condition, group_params = group_condition(account_ids)
+            query += f' AND {condition}'
+            params.extend(group_params)
+        rows = self.connection.execute(query + ' ORDER BY m.start_datetime', params)
+        return [Match.from_dict(json.loads(row[0])) for row in rows]
+
+    def mark_posted(self, channel_id, match_ids, posted_at):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO posted_matches (channel_id, match_id, posted_at) VALUES (?, ?, ?)',
+                [(channel_id, match_id, posted_at) for match_id in match_ids]
+            )
+
+    def get_tracked_accounts(self):
+        # {guild id: account ids} for every guild that picked its own accounts
+        tracked = {}
+        for guild_id, account_id in self.connection.execute(
+            'SELECT guild_id, steam_account_id FROM guild_accounts ORDER BY guild_id, steam_account_id'
+        ):
+            tracked.setdefault(guild_id, []).append(account_id)
+        return tracked
+
+    def track_account(self, guild_id, account_id):
+        # Returns False if the guild already tracks the account
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO guild_accounts (guild_id, steam_account_id) VALUES (?, ?)',
+                (guild_id, account_id)
+            )
+            if cursor.rowcount:
+                # Matches of the account that didn't count for anyone before
+                # may count for this guild. The ones never stored are fetched
+                # again with its backfill window, the stored ones are matched
+                # again by match_tracked_accounts.
+                self.connection.execute(
+                    'DELETE FROM account_watermarks WHERE steam_account_id = ?',
+                    (account_id,)
+                )
+        return bool(cursor.rowcount)
+
+    def match_tracked_accounts(self, account_id, tracking):
+        # Judge the stored matches the account played in again, against the
+        # groups tracked now. Where that adds matched accounts, e.g. once a
+        # second guild tracks a player, the match gets their match_accounts
+        # rows and they are counted in the aggregates. Returns the number of
+        # matches updated.
+        updated = 0
+        with self.connection:
+            # A cheap text filter first, the players are checked below
+            rows = self.connection.execute(
+                'SELECT match_id, match_info FROM matches WHERE instr(match_info, ?) > 0',
+                (str(account_id),)
+            ).fetchall()
+            for match_id, match_info in rows:
+                match_info = json.loads(match_info)
+                player_ids = [player.get('steam_account_id') for player in match_info.get('players', [])]
+                if account_id not in player_ids:
+                    continue
+                matched = set(match_info.get('matched_account_ids') or [])
+                added = tracking.matching_accounts(player_ids) - matched
+                if not added:
+                    continue
+
+                old = Match.from_dict(match_info)
+                match_info['matched_account_ids'] = sorted(matched | added)
+                match = Match.from_dict(match_info)
+                self.connection.execute(
+                    'UPDATE matches SET match_info = ? WHERE match_id = ?',
+                    (json.dumps(as_dict(match)), match_id)
+                )
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO match_accounts (steam_account_id, start_datetime, match_id) '
+                    'VALUES (?, ?, ?)',
+                    [(added_id, match['start_datetime'], match_id) for added_id in sorted(added)]
+                )
+
+                # Counted already, so swap its old counts for the new ones
+                counted = self.connection.execute(
+                    'SELECT 1 FROM aggregated_matches WHERE match_id = ?',
+                    (match_id,)
+                ).fetchone()
+                if counted:
+                    self._add_aggregates(counter_changes(match_counters(old), match_counters(match)))
+                updated += 1
+
+            # Subjects that lost their only match, e.g. the smaller stack
+            self.connection.execute('DELETE FROM aggregates WHERE games = 0')
+        return updated
+
+    def untrack_account(self, guild_id, account_id):
+        # Returns False if the guild didn't track the account
+        with self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM guild_accounts WHERE guild_id = ? AND steam_account_id = ?',
+                (guild_id, account_id)
+            )
+        return bool(cursor.rowcount)
+
+    def get_match_channels(self):
+        # {guild id: channel new matches are posted to}
+        return dict(self.connection.execute('SELECT guild_id, channel_id FROM guild_channels').fetchall())
+
+    def set_match_channel(self, guild_id, channel_id):
+        # None stops posting for the guild
+        with self.connection:
+            if channel_id is None:
+                self.connection.execute('DELETE FROM guild_channels WHERE guild_id = ?', (guild_id,))
+            else:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO guild_channels (guild_id, channel_id) VALUES (?, ?)',
+                    (guild_id, channel_id)
+                )
+
+
+def group_condition(account_ids):
+    # SQL condition and parameters for matches with at least two of the
+    # accounts, i.e. a guild's own party matches
+    account_ids = list(account_ids)
+    placeholders = ','.join('?' * len(account_ids))
+    condition = (
+        f'm.match_id IN ('
+        f'SELECT match_id FROM match_accounts WHERE steam_account_id IN ({placeholders}) '
+        f'GROUP BY match_id HAVING COUNT(*) >= ?)'
+    )
+    return condition, account_ids + [MIN_TRACKED_PLAYERS]
@@ -0,0 +1,131 @@
+import json
+import asyncio
+import contextlib
+import aiohttp
+from scheduler import RequestScheduler, BACKGROUND, RETRY_STATUSES
+from tracing import stage, GRAPHQL_REQUEST, JSON_PARSE
+
+# Default number of GraphQL requests allowed in flight at once
+DEFAULT_CONCURRENCY = 4
+
+
+class StratzClient:
+    def __init__(self, endpoint, api_key, concurrency=DEFAULT_CONCURRENCY, timeout=30, scheduler=None):
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+        # Every request waits for the scheduler, which enforces the rate
+        # limits and decides retry delays
+        self.scheduler = scheduler or RequestScheduler()
+
+        # Headers are built once and shared by every request on the session
+        self.headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}',
+            'User-Agent': 'STRATZ_API'
+        }
+
+        self._session = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self):
+        # The session has to be created inside a running event loop, so it is
+        # opened lazily on first use and then reused for every request
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=self.timeout
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def query(self, query, priority=BACKGROUND):
+        # Send a single GraphQL query and return the decoded JSON response,
+        # retrying rate limited, failed and dropped requests
+        session = self._get_session()
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(priority)
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    with stage(GRAPHQL_REQUEST):
+                        async with session.post(self.endpoint, json={'query': query}) as response:
+                            if response.status not in RETRY_STATUSES or attempt >= self.scheduler.max_retries:
+                                # Raise an exception for bad responses
+                                response.raise_for_status()
+                                body = await response.read()
+                                break
+                            retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.scheduler.max_retries:
+                    raise
+
+            await asyncio.sleep(self.scheduler.backoff(attempt, retry_after))
+            attempt += 1
+
+        with stage(JSON_PARSE):
+            return json.loads(body)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, query, priority=BACKGROUND):
+        # Like query, but hands over the open response so the body can be
+        # parsed as it arrives instead of being read whole. Only failures
+        # before the body starts are retried, a partly consumed body can't be.
+        session = self._get_session()
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(priority)
+            retry_after = None
+            await self._semaphore.acquire()
+            handed_over = False
+            try:
+                with stage(GRAPHQL_REQUEST):
+                    response = await session.post(self.endpoint, json={'query': query})
+                if response.status not in RETRY_STATUSES or attempt >= self.scheduler.max_retries:
+                    handed_over = True
+                    break
+                retry_after = response.headers.get('Retry-After')
+                response.release()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.scheduler.max_retries:
+                    raise
+            finally:
+                # The permit is only kept for the response handed over below,
+                # any other way out of here, cancellation included, gives it back
+                if not handed_over:
+                    self._semaphore.release()
+
+            await asyncio.sleep(self.scheduler.backoff(attempt, retry_after))
+            attempt += 1
+
+        try:
+            # Raise an exception for bad responses
+            response.raise_for_status()
+            yield response
+        finally:
+            response.release()
+            self._semaphore.release()
+
+    async def query_many(self, queries, priority=BACKGROUND):
+        # Send several queries concurrently (bounded by the semaphore) and
+        # return the responses in the same order. Failed queries come back
+        # as the exception instead of a response.
+        return await asyncio.gather(
+            *(self.query(query, priority) for query in queries),
+            return_exceptions=True
+        )
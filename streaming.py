@@ -0,0 +1,135 @@
+import ijson
+from models import Match
+
+# Incremental parsing of aliased players(...) responses. Matches are built
+# one at a time from parser events while the body is still arriving, and a
+# match whose id is already known is skipped without being built at all, so
+# memory doesn't grow with the size of the response.
+
+# What happens to the events of the match being parsed
+PENDING = 0  # id not seen yet, events are held back
+BUILD = 1    # new match, events go to the builder
+SKIP = 2     # known match, events are dropped
+
+
+class MatchStream:
+    def __init__(self, aliases, tracking, processed_match_ids, is_known=None):
+        # aliases maps each alias in the document to the accounts its
+        # players(...) field asked for, tracking is a tracking.Tracking.
+        # is_known(match_id) lets the caller treat matches it already has,
+        # e.g. in a store, as duplicates.
+        self.tracking = tracking
+        self.processed_match_ids = processed_match_ids
+        self.is_known = is_known
+        self.batches = {alias: set(account_ids) for alias, account_ids in aliases.items()}
+        self.match_prefixes = {f'data.{alias}.item.matches.item': alias for alias in aliases}
+
+        # Newest match start time per tracked account, like collect_watermarks
+        self.watermarks = {}
+
+        self.alias = None
+
+    def _start(self, prefix, alias):
+        self.alias = alias
+        self.prefix = prefix
+        self.id_prefix = prefix + '.id'
+        self.start_prefix = prefix + '.startDateTime'
+        self.account_prefix = prefix + '.players.item.steamAccount.id'
+
+        self.state = PENDING
+        self.pending = [('start_map', None)]
+        self.builder = None
+        self.match_id = None
+        self.start_datetime = None
+        self.account_ids = []
+
+    def _decide(self):
+        # Runs as soon as the id is known, which with id requested first is
+        # before any of the match body
+        match_id = self.match_id
+        known = match_id in self.processed_match_ids
+        if not known and self.is_known is not None and self.is_known(match_id):
+            self.processed_match_ids.add(match_id)
+            known = True
+
+        if known:
+            self.state = SKIP
+        else:
+            self.state = BUILD
+            self.builder = ijson.ObjectBuilder()
+            for event, value in self.pending:
+                self.builder.event(event, value)
+        self.pending = None
+
+    def _finish(self):
+        batch = self.batches[self.alias]
+        self.alias = None
+
+        # Watermarks count every match, including ones that get rejected
+        if self.start_datetime is not None:
+            for account_id in self.account_ids:
+                if account_id in batch:
+                    self.watermarks[account_id] = max(self.watermarks.get(account_id, 0), self.start_datetime)
+
+        if self.state == SKIP:
+            return None
+        if self.state == PENDING:
+            # No id in the match, build it from what was held back
+            self.builder = ijson.ObjectBuilder()
+            for event, value in self.pending:
+                self.builder.event(event, value)
+
+        # Check if at least two tracked accounts of the same guild are in
+        # this match
+        matching_accounts = self.tracking.matching_accounts(self.account_ids)
+        if not matching_accounts:
+            return None
+
+        self.processed_match_ids.add(self.match_id)
+        return Match.from_response(self.builder.value, matching_accounts)
+
+    def feed(self, prefix, event, value):
+        # Feed one (prefix, event, value) parser event, returns the match it
+        # completes if that match was accepted
+        if self.alias is None:
+            alias = self.match_prefixes.get(prefix)
+            if alias is not None and event == 'start_map':
+                self._start(prefix, alias)
+            return None
+
+        if prefix == self.prefix and event == 'end_map':
+            if self.state == BUILD:
+                self.builder.event(event, value)
+            elif self.state == PENDING:
+                self.pending.append((event, value))
+            return self._finish()
+
+        if prefix == self.account_prefix:
+            self.account_ids.append(value)
+        elif prefix == self.start_prefix and event == 'number':
+            self.start_datetime = value
+
+        if self.state == BUILD:
+            self.builder.event(event, value)
+        elif self.state == PENDING:
+            self.pending.append((event, value))
+            if prefix == self.id_prefix and event == 'number':
+                self.match_id = value
+                self._decide()
+        return None
+
+
+def parse_matches(file, stream):
+    # Blocking form, for a file or anything else with read()
+    for prefix, event, value in ijson.parse(file, use_float=True):
+        match = stream.feed(prefix, event, value)
+        if match is not None:
+            yield match
+
+
+async def parse_matches_async(response, stream):
+    # Parse an aiohttp response body as it is received
+    async for prefix, event, value in ijson.parse_async(response.content, use_float=True):
+        match = stream.feed(prefix, event, value)
+        if match is not None:
+            yield match
@@ -0,0 +1,127 @@
+import io
+import re
+import zlib
+import json
+import asyncio
+import argparse
+import itertools
+from aiohttp import web
+
+# Local stand-in for the STRATZ GraphQL endpoint, used to exercise the request
+# scheduler and to benchmark without spending API quota. Point
+# DOTA_API_ENDPOINT at http://127.0.0.1:<port>/graphql to use it, and
+# DOTA_CDN_URL at http://127.0.0.1:<port> to serve placeholder images too.
+
+EMPTY_RESPONSE = {'data': {'players': []}}
+
+# Aliased root fields in a document built by queries.build_document
+ALIAS_PATTERN = re.compile(r'(\w+)\s*:\s*(\w+)\s*[({]')
+
+
+def replay_response(query, fixtures):
+    # Answer each aliased root field with the recorded response for that
+    # root field, e.g. every players(...) field gets the recorded players
+    data = {}
+    for alias, field in ALIAS_PATTERN.findall(query):
+        if field in fixtures and alias not in data:
+            data[alias] = fixtures[field].get('data', {}).get(field)
+    return {'data': data}
+
+
+def placeholder_png(name, size):
+    # Solid colour image derived from the name
+    from PIL import Image
+    colour = tuple(zlib.crc32(name.encode()) >> shift & 0xFF for shift in (0, 8, 16))
+    buffer = io.BytesIO()
+    Image.new('RGB', size, colour).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def create_app(rate_limit_every=0, error_every=0, retry_after=1, response=None,
+               fixtures=None, latency=0):
+    # rate_limit_every=N answers every Nth request with a 429 and
+    # error_every=N answers every Nth request with a 503, 0 disables either.
+    # fixtures maps a root field name to a recorded response to replay, and
+    # latency delays every GraphQL response by that many seconds.
+    counter = itertools.count(1)
+    stats = {'requests': 0, 'rate_limited': 0, 'errors': 0}
+    images = {}
+
+    async def graphql(request):
+        body = await request.read()
+        number = next(counter)
+        stats['requests'] += 1
+
+        if latency:
+            await asyncio.sleep(latency)
+
+        if rate_limit_every and number % rate_limit_every == 0:
+            stats['rate_limited'] += 1
+            return web.json_response(
+                {'message': 'API rate limit exceeded'},
+                status=429,
+                headers={'Retry-After': str(retry_after)}
+            )
+
+        if error_every and number % error_every == 0:
+            stats['errors'] += 1
+            return web.json_response({'message': 'Service unavailable'}, status=503)
+
+        if fixtures:
+            query = json.loads(body).get('query', '')
+            return web.json_response(replay_response(query, fixtures))
+
+        return web.json_response(response if response is not None else EMPTY_RESPONSE)
+
+    async def image(request):
+        kind = request.match_info['kind']
+        name = request.match_info['name']
+        size = (256, 144) if kind == 'heroes' else (88, 64)
+        if (kind, name) not in images:
+            images[(kind, name)] = placeholder_png(name, size)
+        return web.Response(body=images[(kind, name)], content_type='image/png')
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app['stats'] = stats
+    app.router.add_post('/graphql', graphql)
+    app.router.add_get('/stats', get_stats)
+    app.router.add_get('/{kind:heroes|items}/{name}.png', image)
+    return app
+
+
+def load_fixtures(paths):
+    # Each fixture file is a recorded response, keyed by its root field
+    fixtures = {}
+    for path in paths:
+        with open(path) as file:
+            recorded = json.load(file)
+        for field in recorded.get('data', {}):
+            fixtures[field] = recorded
+    return fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub STRATZ GraphQL server')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rate-limit-every', type=int, default=0)
+    parser.add_argument('--error-every', type=int, default=0)
+    parser.add_argument('--retry-after', type=float, default=1)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--fixture', action='append', default=[])
+    args = parser.parse_args()
+
+    app = create_app(
+        rate_limit_every=args.rate_limit_every,
+        error_every=args.error_every,
+        retry_after=args.retry_after,
+        fixtures=load_fixtures(args.fixture),
+        latency=args.latency
+    )
+    web.run_app(app, host='127.0.0.1', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
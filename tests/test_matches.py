@@ -0,0 +1,88 @@
+import asyncio
+import matches
+from models import Match
+
+
+class ReplayClient:
+    # Answers every request with the next of the given responses
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.queries = []
+
+    async def query_many(self, queries, priority=None):
+        self.queries.extend(queries)
+        return [self.responses.pop(0) for _ in queries]
+
+
+def probe(responses, account_ids, batch_size):
+    client = ReplayClient(responses)
+    return asyncio.run(matches.get_latest_match_ids_async(client, account_ids, batch_size=batch_size))
+
+
+def test_probe_reads_newest_match_per_account():
+    response = {'data': {
+        'q0': [
+            {'steamAccountId': 1, 'matches': [{'id': 50, 'startDateTime': 1000}]},
+            {'steamAccountId': 2, 'matches': []}
+        ]
+    }}
+    # Account 3 was asked for but left out of the answer
+    assert probe([response], [1, 2, 3], 3) == {1: (50, 1000), 2: None, 3: None}
+
+
+def test_probe_leaves_out_batches_with_errors():
+    # The second batch's field failed while the first answered
+    response = {
+        'data': {
+            'q0': [{'steamAccountId': 1, 'matches': [{'id': 50, 'startDateTime': 1000}]}],
+            'q1': None
+        },
+        'errors': [{'message': 'Internal error', 'path': ['q1']}]
+    }
+    assert probe([response], [1, 2, 3], 1) == {1: (50, 1000)}
+
+
+def test_probe_leaves_out_failed_requests():
+    assert probe([RuntimeError('down')], [1, 2, 3], 3) == {}
+    # A response without any players is no better than a failed one
+    assert probe([{'data': {'q0': None}}], [1, 2, 3], 3) == {}
+
+
+def test_changed_accounts_skips_quiet_and_old_accounts():
+    latest = {1: (50, 1000), 2: (60, 2000), 3: None, 4: (70, 100)}
+    assert matches.changed_accounts(latest, {1: 1000, 2: 1500}, 500) == [2]
+
+
+def match_without_details(match_id):
+    return Match.from_dict({'match_id': match_id, 'players': []})
+
+
+def load_details(responses, match_ids):
+    loaded = [match_without_details(match_id) for match_id in match_ids]
+    asyncio.run(matches.load_match_details_async(ReplayClient(responses), loaded))
+    return loaded
+
+
+def test_details_are_attached():
+    response = {'data': {'q0': {'radiantNetworthLeads': [0, 100], 'radiantExperienceLeads': [0, 50]}}}
+    match, = load_details([response], [5])
+    assert match.has_details
+    assert match['radiant_networth_leads'] == [0, 100]
+
+
+def test_missing_leads_count_as_loaded():
+    # Unparsed matches have no leads, that's the final answer for them
+    response = {'data': {'q0': {'radiantNetworthLeads': None, 'radiantExperienceLeads': None}}}
+    match, = load_details([response], [5])
+    assert match.has_details
+    assert match['radiant_networth_leads'] == []
+
+
+def test_failed_details_are_fetched_again():
+    errored = {'data': {'q0': None, 'q1': None}, 'errors': [{'message': 'timeout', 'path': ['q0']}]}
+    first, second = load_details([errored], [5, 6])
+    assert not first.has_details
+    # No error, but no match either
+    assert not second.has_details
+    failed, = load_details([RuntimeError('down')], [7])
+    assert not failed.has_details
@@ -0,0 +1,129 @@
+import random
+import time
+from benchmarks.synthetic import synthetic_players_response
+from models import Match
+from store import MatchStore
+import matches
+import stats
+from stats import ACCOUNT, HERO, ACCOUNT_HERO, STACK, BUCKET_SECONDS
+
+START = 1700000000
+
+
+def player(account_id, is_radiant, hero, kills, deaths, assists, networth, lane):
+    return {
+        'steam_account_id': account_id,
+        'steam_account_name': f'Player {account_id}',
+        'is_radiant': is_radiant,
+        'hero': {'id': 1, 'short_name': hero, 'name': f'npc_dota_hero_{hero}'},
+        'performance': {
+            'kills': kills, 'deaths': deaths, 'assists': assists,
+            'networth': networth, 'lane': lane, 'role': 'CORE'
+        },
+        'items': [],
+        'neutral_item': None
+    }
+
+
+def party_match(match_id=1, start_datetime=START, radiant_win=True):
+    # Tracked 1 and 2 together on radiant, tracked 3 alone on dire, and one
+    # stranger. Radiant won the bottom lane and lost the top one.
+    return Match.from_dict({
+        'match_id': match_id,
+        'start_datetime': start_datetime,
+        'radiant_win': radiant_win,
+        'lane_outcomes': {'mid': 'TIE', 'bottom': 'RADIANT_VICTORY', 'top': 'DIRE_STOMP'},
+        'matched_account_ids': [1, 2, 3],
+        'players': [
+            player(1, True, 'lina', 10, 2, 5, 20000, 'SAFE_LANE'),
+            player(2, True, 'axe', 4, 6, 12, 14000, 'OFF_LANE'),
+            player(3, False, 'lion', 1, 8, 9, 8000, 'MID_LANE'),
+            player(99, False, 'pudge', 7, 3, 3, 15000, 'SAFE_LANE')
+        ]
+    })
+
+
+def test_match_counters_per_player_and_hero():
+    counters = stats.match_counters(party_match())
+    bucket = START // BUCKET_SECONDS
+    assert counters[(ACCOUNT, '1', bucket)] == (1, 1, 10, 2, 5, 20000, 1, 0, 0)
+    assert counters[(ACCOUNT, '2', bucket)] == (1, 1, 4, 6, 12, 14000, 0, 0, 1)
+    # Lost the match, tied mid
+    assert counters[(ACCOUNT, '3', bucket)] == (1, 0, 1, 8, 9, 8000, 0, 1, 0)
+    assert counters[(HERO, 'lina', bucket)] == counters[(ACCOUNT, '1', bucket)]
+    assert counters[(ACCOUNT_HERO, '2:axe', bucket)] == counters[(ACCOUNT, '2', bucket)]
+    # Players who aren't tracked aren't counted at all
+    assert (ACCOUNT, '99', bucket) not in counters
+    assert (HERO, 'pudge', bucket) not in counters
+
+
+def test_match_counters_count_a_stack_once():
+    counters = stats.match_counters(party_match())
+    bucket = START // BUCKET_SECONDS
+    # One game and one win for the stack, its members' other counters summed
+    assert counters[(STACK, '1,2', bucket)] == (1, 1, 14, 8, 17, 34000, 1, 0, 1)
+    # A tracked player alone on a team isn't a stack
+    assert [key for key in counters if key[0] == STACK] == [(STACK, '1,2', bucket)]
+
+
+def test_summarize_averages_stacks_per_member():
+    summary = stats.summarize((2, 1, 28, 16, 34, 68000, 2, 0, 2), players=2)
+    assert summary['winrate'] == 0.5
+    assert summary['kills_per_game'] == 7
+    assert summary['networth_per_game'] == 17000
+    assert summary['kda'] == (28 + 34) / 16
+    assert stats.summarize((0,) * len(stats.COUNTERS)) is None
+
+
+def test_get_stats_reads_the_period_from_the_store(tmp_path):
+    store = MatchStore(str(tmp_path / 'matches.db'))
+    now = START + 10 * BUCKET_SECONDS
+    store.save_matches([
+        party_match(1, START + 9 * BUCKET_SECONDS, radiant_win=True),
+        party_match(2, START + 8 * BUCKET_SECONDS, radiant_win=False),
+        # Outside a 5 day window
+        party_match(3, START, radiant_win=True)
+    ])
+    players = stats.get_stats(store, ACCOUNT, days=5, now=now)
+    assert players['1']['games'] == 2
+    assert players['1']['winrate'] == 0.5
+    assert stats.get_stats(store, ACCOUNT, days=0, now=now)['1']['games'] == 3
+
+    # One guild's view only has its own players and stacks
+    guild = stats.get_stats(store, STACK, days=0, now=now, account_ids={1, 3})
+    assert guild == {}
+    assert list(stats.get_stats(store, ACCOUNT, days=0, now=now, account_ids={1, 3})) == ['1', '3']
+    store.close()
+
+
+def test_saving_again_does_not_count_twice(tmp_path):
+    store = MatchStore(str(tmp_path / 'matches.db'))
+    store.save_matches([party_match(1)])
+    store.save_matches([party_match(1)], replace=True)
+    assert stats.get_stats(store, ACCOUNT, days=0)['1']['games'] == 1
+    store.close()
+
+
+def test_rebuild_matches_incremental_counts(tmp_path):
+    store = MatchStore(str(tmp_path / 'matches.db'))
+    response = synthetic_players_response(matches.STEAM_ACCOUNT_IDS, 60, 3, start_datetime=int(time.time()) - 200000)
+    processed = matches.process_matches(response, set(), tracking=matches.get_tracking())
+    # Saved in a few chunks, as fetches come in
+    random.Random(0).shuffle(processed)
+    for start in range(0, len(processed), 7):
+        store.save_matches(processed[start:start + 7])
+
+    def aggregates():
+        return sorted(store.connection.execute('SELECT * FROM aggregates').fetchall())
+
+    incremental = aggregates()
+    assert store.rebuild_aggregates(chunk_size=10) == len(processed)
+    assert aggregates() == incremental
+
+    # And both equal adding up match_counters over every stored match
+    totals = {}
+    for match in processed:
+        for key, counters in stats.match_counters(match).items():
+            totals[key] = stats.add_counters(totals.get(key), counters)
+    assert incremental == sorted(key + counters for key, counters in totals.items())
+    store.close()
@@ -0,0 +1,62 @@
+import random
+import time
+from benchmarks.synthetic import synthetic_raw_match
+from models import Match
+from store import MatchStore
+from tracking import Tracking
+
+
+def stored_match(store, match_id, player_ids, matched_account_ids):
+    # A match with the given players on one team, stored as matched for
+    # matched_account_ids
+    raw = synthetic_raw_match(match_id, int(time.time()) - 3600, player_ids, random.Random(match_id))
+    match = Match.from_response(raw, matched_account_ids)
+    store.save_matches([match])
+    return match
+
+
+def aggregates(store):
+    return sorted(store.connection.execute('SELECT * FROM aggregates').fetchall())
+
+
+def test_tracking_an_account_matches_stored_matches_again(tmp_path):
+    store = MatchStore(str(tmp_path / 'matches.db'))
+    # Guild 10 tracks 1 and 2, the match with 1, 2 and 3 counts for it
+    store.track_account(10, 1)
+    store.track_account(10, 2)
+    stored_match(store, 5, [1, 2, 3], [1, 2])
+    assert store.get_matches(account_ids=[2, 3]) == []
+
+    # Guild 20 tracking 2 and 3 makes it a party match for that guild too
+    store.track_account(20, 2)
+    store.track_account(20, 3)
+    tracking = Tracking(store.get_tracked_accounts())
+    assert store.match_tracked_accounts(3, tracking) == 1
+
+    assert [match.match_id for match in store.get_matches(account_ids=[2, 3])] == [5]
+    assert [match.match_id for match in store.get_matches(account_id=3)] == [5]
+    assert sorted(store.get_match(5)['matched_account_ids']) == [1, 2, 3]
+
+    # The aggregates are the same as counting the updated match from scratch
+    updated = aggregates(store)
+    store.rebuild_aggregates()
+    assert updated == aggregates(store)
+
+    # Nothing changes the second time
+    assert store.match_tracked_accounts(3, tracking) == 0
+    store.close()
+
+
+def test_tracking_leaves_matches_that_still_do_not_count(tmp_path):
+    store = MatchStore(str(tmp_path / 'matches.db'))
+    store.track_account(10, 1)
+    store.track_account(10, 2)
+    stored_match(store, 5, [1, 2, 3], [1, 2])
+    before = aggregates(store)
+
+    # Alone in its guild, 3 doesn't make a party match for it
+    store.track_account(20, 3)
+    assert store.match_tracked_accounts(3, Tracking(store.get_tracked_accounts())) == 0
+    assert store.get_match(5)['matched_account_ids'] == [1, 2]
+    assert aggregates(store) == before
+    store.close()
@@ -0,0 +1,90 @@
+import time
+import asyncio
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestServer
+from scheduler import RequestScheduler
+from stratz import StratzClient, DEFAULT_CONCURRENCY
+from stub_server import create_app, EMPTY_RESPONSE
+
+# Seconds the stub asks to wait in its Retry-After header
+RETRY_AFTER = 0.2
+
+QUERY = '{ players(steamAccountIds: [1]) { steamAccountId } }'
+
+
+def run_against_stub(test, max_retries=3, **stub_options):
+    # Runs test(client) against a stub STRATZ server on a free port and
+    # returns its result along with the stub's request counts. The
+    # scheduler's own rate limits are out of the way, so any waiting comes
+    # from the retries.
+    async def main():
+        app = create_app(retry_after=RETRY_AFTER, **stub_options)
+        server = TestServer(app)
+        await server.start_server()
+        scheduler = RequestScheduler(per_second=1000, per_minute=60000, max_retries=max_retries, base_delay=0.01)
+        try:
+            async with StratzClient(str(server.make_url('/graphql')), 'key', scheduler=scheduler) as client:
+                return await test(client), dict(app['stats'])
+        finally:
+            await server.close()
+
+    return asyncio.run(main())
+
+
+def test_query_retries_rate_limited_requests():
+    async def test(client):
+        started = time.monotonic()
+        responses = [await client.query(QUERY) for _ in range(3)]
+        return responses, time.monotonic() - started
+
+    # Every second request is rate limited: 1 ok, 2 429, 3 ok, 4 429, 5 ok
+    (responses, elapsed), stats = run_against_stub(test, rate_limit_every=2)
+    assert responses == [EMPTY_RESPONSE] * 3
+    assert stats == {'requests': 5, 'rate_limited': 2, 'errors': 0}
+    # Each 429 is retried no sooner than its Retry-After
+    assert elapsed >= 2 * RETRY_AFTER
+
+
+def test_query_retries_server_errors():
+    async def test(client):
+        return [await client.query(QUERY) for _ in range(3)]
+
+    responses, stats = run_against_stub(test, error_every=2)
+    assert responses == [EMPTY_RESPONSE] * 3
+    assert stats == {'requests': 5, 'rate_limited': 0, 'errors': 2}
+
+
+def test_query_gives_up_after_max_retries():
+    async def test(client):
+        with pytest.raises(aiohttp.ClientResponseError) as error:
+            await client.query(QUERY)
+        return error.value.status
+
+    status, stats = run_against_stub(test, max_retries=2, rate_limit_every=1)
+    assert status == 429
+    # The first attempt and two retries
+    assert stats['requests'] == 3
+    assert stats['rate_limited'] == 3
+
+
+def test_stream_retries_and_gives_back_permits():
+    async def test(client):
+        bodies = []
+        for _ in range(3):
+            async with client.stream(QUERY) as response:
+                bodies.append(await response.json())
+        return bodies, client._semaphore._value
+
+    (bodies, permits), stats = run_against_stub(test, rate_limit_every=2)
+    assert bodies == [EMPTY_RESPONSE] * 3
+    assert stats['rate_limited'] == 2
+    assert permits == DEFAULT_CONCURRENCY
+
+
+def test_backoff_grows_and_respects_retry_after():
+    scheduler = RequestScheduler(base_delay=0.5, max_delay=30)
+    for attempt in range(6):
+        assert 0 <= scheduler.backoff(attempt) <= min(30, 0.5 * 2 ** attempt)
+    assert scheduler.backoff(0, '2') >= 2
+    assert scheduler.backoff(0, 'not a delay') <= 0.5
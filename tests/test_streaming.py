@@ -0,0 +1,56 @@
+import io
+import json
+from benchmarks.synthetic import synthetic_players_response
+import matches
+from queries import batch_accounts
+from streaming import MatchStream, parse_matches
+from tracking import Tracking
+
+
+def aliased_response(response, batches):
+    # The players of each batch under its own alias, like execute sends them
+    by_account = {player['steamAccountId']: player for player in response['data']['players']}
+    return {'data': {
+        f'q{i}': [by_account[account_id] for account_id in batch]
+        for i, batch in enumerate(batches)
+    }}
+
+
+def stream_matches(response, batches, tracking, processed=None, is_known=None):
+    body = io.BytesIO(json.dumps(aliased_response(response, batches)).encode())
+    stream = MatchStream(
+        {f'q{i}': batch for i, batch in enumerate(batches)}, tracking, set(processed or ()), is_known
+    )
+    return list(parse_matches(body, stream)), stream
+
+
+def test_streaming_matches_process_matches():
+    account_ids = matches.STEAM_ACCOUNT_IDS
+    tracking = Tracking({10: account_ids[:4], 20: account_ids[3:]})
+    response = synthetic_players_response(account_ids, 80, 1)
+
+    expected = matches.process_matches(response, set(), tracking=tracking)
+    streamed, _ = stream_matches(response, batch_accounts(account_ids, 4), tracking)
+
+    assert expected
+    assert [match.to_dict() for match in streamed] == [match.to_dict() for match in expected]
+
+
+def test_streaming_skips_known_matches_but_counts_their_watermarks():
+    account_ids = matches.STEAM_ACCOUNT_IDS
+    tracking = Tracking({0: account_ids})
+    response = synthetic_players_response(account_ids, 40, 2)
+    everything, _ = stream_matches(response, [account_ids], tracking)
+
+    known = {match.match_id for match in everything[::2]}
+    streamed, stream = stream_matches(response, [account_ids], tracking, is_known=known.__contains__)
+    assert [match.match_id for match in streamed] == [
+        match.match_id for match in everything if match.match_id not in known
+    ]
+
+    # Newest start time per account over every match, known or not
+    newest = {}
+    for player in response['data']['players']:
+        for match in player['matches']:
+            newest[player['steamAccountId']] = max(newest.get(player['steamAccountId'], 0), match['startDateTime'])
+    assert stream.watermarks == newest
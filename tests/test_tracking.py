@@ -0,0 +1,26 @@
+from tracking import Tracking, DEFAULT_GROUP
+
+
+def test_accounts_are_fetched_once_across_groups():
+    tracking = Tracking({DEFAULT_GROUP: [1, 2, 3], 10: [3, 4], 20: [], 30: [4, 1]})
+    assert tracking.account_ids == [1, 2, 3, 4]
+    # Groups without accounts are dropped
+    assert set(tracking.groups) == {DEFAULT_GROUP, 10, 30}
+    assert sorted(tracking.account_groups[4]) == [10, 30]
+
+
+def test_matching_accounts_needs_two_of_one_group():
+    tracking = Tracking({10: [1, 2], 20: [3, 4]})
+    assert tracking.matching_accounts([1, 2, 99]) == {1, 2}
+    # One player of each group is a party match for neither
+    assert tracking.matching_accounts([1, 3, 99]) == set()
+    assert tracking.matching_accounts([1, 2, 3]) == {1, 2}
+    assert tracking.matching_accounts([1, 2, 3, 4]) == {1, 2, 3, 4}
+
+
+def test_matching_accounts_unions_overlapping_groups():
+    tracking = Tracking({10: [1, 2], 20: [2, 3]})
+    assert tracking.matching_accounts([2, 3]) == {2, 3}
+    assert tracking.matching_accounts([1, 2, 3]) == {1, 2, 3}
+    # Repeated ids don't make a party
+    assert tracking.matching_accounts([1, 1]) == set()
@@ -0,0 +1,165 @@
+import time
+import bisect
+import logging
+import functools
+
+# Per-stage timing for the fetch/process/render pipeline. Recording is only
+# active while the 'trace' logger is enabled for DEBUG, e.g.
+#   logging.getLogger('trace').setLevel(logging.DEBUG)
+# and costs a single level check per stage otherwise.
+
+logger = logging.getLogger('trace')
+
+# Pipeline stages, in order
+GRAPHQL_REQUEST = 'graphql_request'
+JSON_PARSE = 'json_parse'
+PROCESS_MATCHES = 'process_matches'
+LAYOUT = 'layout'
+PAINT = 'paint'
+ENCODE = 'encode'
+DISCORD_UPLOAD = 'discord_upload'
+
+STAGES = (GRAPHQL_REQUEST, JSON_PARSE, PROCESS_MATCHES, LAYOUT, PAINT, ENCODE, DISCORD_UPLOAD)
+
+# Histogram bucket upper bounds in milliseconds, the last bucket is unbounded
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, seconds):
+        milliseconds = seconds * 1000
+        self.count += 1
+        self.total += milliseconds
+        self.minimum = milliseconds if self.minimum is None else min(self.minimum, milliseconds)
+        self.maximum = milliseconds if self.maximum is None else max(self.maximum, milliseconds)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, milliseconds)] += 1
+
+    def merge(self, exported):
+        # Fold in a histogram exported by another process
+        if not exported['count']:
+            return
+        self.count += exported['count']
+        self.total += exported['total_ms']
+        self.minimum = exported['min_ms'] if self.minimum is None else min(self.minimum, exported['min_ms'])
+        self.maximum = exported['max_ms'] if self.maximum is None else max(self.maximum, exported['max_ms'])
+        for i, count in enumerate(exported['buckets']):
+            self.buckets[i] += count
+
+    def export(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'min_ms': self.minimum,
+            'max_ms': self.maximum,
+            'buckets': list(self.buckets)
+        }
+
+
+histograms = {}
+
+
+class Stage:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.started)
+
+
+class NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+def enabled():
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def stage(name):
+    # with stage(PAINT): ...
+    if logger.isEnabledFor(logging.DEBUG):
+        return Stage(name)
+    return NULL_STAGE
+
+
+def timed(name):
+    # Decorator form of stage
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not logger.isEnabledFor(logging.DEBUG):
+                return function(*args, **kwargs)
+            with Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.add(seconds)
+
+
+def export():
+    # Stage name -> histogram summary, pipeline stages first
+    ordered = [name for name in STAGES if name in histograms]
+    ordered += sorted(name for name in histograms if name not in STAGES)
+    return {name: histograms[name].export() for name in ordered}
+
+
+def merge(exported):
+    for name, summary in exported.items():
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.merge(summary)
+
+
+def reset():
+    histograms.clear()
+
+
+def drain():
+    # Export and reset, used to ship a worker's timings back to the parent
+    exported = export()
+    reset()
+    return exported
+
+
+def format_summary(exported=None):
+    exported = export() if exported is None else exported
+    if not exported:
+        return 'No stage timings recorded'
+    lines = []
+    for name, summary in exported.items():
+        lines.append(
+            f"{name:<16} {summary['count']:>6}x  mean {summary['mean_ms']:8.2f}ms  "
+            f"min {summary['min_ms']:8.2f}ms  max {summary['max_ms']:8.2f}ms"
+        )
+    return '\n'.join(lines)
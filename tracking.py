@@ -0,0 +1,41 @@
+# Accounts tracked by each guild. Fetching is planned over every guild's
+# accounts at once, so an account tracked by several guilds is still only
+# asked for once. Which guild sees which match is decided when reading from
+# the store, see store.group_condition.
+
+# Tracked players that have to be in a match for it to count as a party match
+MIN_TRACKED_PLAYERS = 2
+
+# Group of the accounts configured for the whole deployment, used by guilds
+# that haven't picked their own
+DEFAULT_GROUP = 0
+
+
+class Tracking:
+    def __init__(self, groups):
+        # groups maps a guild id, or DEFAULT_GROUP, to its account ids
+        self.groups = {group: frozenset(account_ids) for group, account_ids in groups.items() if account_ids}
+
+        # Groups of each account, so a match only looks at the groups of the
+        # players in it rather than at every guild
+        self.account_groups = {}
+        for group, account_ids in self.groups.items():
+            for account_id in account_ids:
+                self.account_groups.setdefault(account_id, []).append(group)
+
+        # Every distinct account, what gets fetched
+        self.account_ids = sorted(self.account_groups)
+
+    def matching_accounts(self, account_ids):
+        # The tracked accounts of a match that are in a group with enough of
+        # the other players, the union of each group's own filter
+        found = {}
+        for account_id in set(account_ids):
+            for group in self.account_groups.get(account_id, ()):
+                found.setdefault(group, []).append(account_id)
+
+        matched = set()
+        for members in found.values():
+            if len(members) >= MIN_TRACKED_PLAYERS:
+                matched.update(members)
+        return matched